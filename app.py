@@ -49,210 +49,2547 @@
 # %%
 #import dependencies
 import pandas as pd
-import plotly.express as px
 import dash
-from dash import Dash, dcc, html, Input, Output
+import flask
+from dash import Dash, dcc, html, Input, Output, State, Patch, ClientsideFunction
 from dash import dash_table
-from datetime import datetime
+from dash.exceptions import PreventUpdate
+from dash.development.base_component import Component
 import numpy as np
 import plotly.graph_objects as go
+import plotly.io as pio
+from collections import OrderedDict, deque
+import copy
+from contextlib import contextmanager
+from dataclasses import dataclass, replace, asdict
+import threading
+import re
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import urllib.parse
+import multiprocessing
+import uuid
+from concurrent.futures import ProcessPoolExecutor, CancelledError, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import io
+import logging
+import pickle
+import base64
+from functools import wraps
+import time
+import cProfile
+# optional: only the Parquet export needs it
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# %% [markdown]
+# ### Employee Data Schema
+#
+# Only the columns the dashboard uses are loaded, each with an explicit type: low-cardinality text as `category`, free
+# text such as the employee names as `category` too, so its codes can be memory-mapped (see Columnar Data Cache),
+# numbers downcast to the smallest integer/float type that fits, and dates parsed once into `datetime64`. Text values are
+# whitespace-normalized on load, so padded values such as `'Production       '` and `'M '` match their clean spelling.
+
+# %%
+# column -> kind for every column the dashboard reads from the csv
+EMPLOYEE_SCHEMA = {
+    'Employee_Name': 'text',
+    'EmpID': 'integer',
+    'Salary': 'integer',
+    'Position': 'category',
+    'DOB': 'date',
+    'Sex': 'category',
+    'MaritalDesc': 'category',
+    'RaceDesc': 'category',
+    'DateofHire': 'date',
+    'DateofTermination': 'date',
+    'EmploymentStatus': 'category',
+    'Department': 'category',
+    'ManagerName': 'category',
+    'RecruitmentSource': 'category',
+    'PerformanceScore': 'category',
+    'EngagementSurvey': 'float',
+    'EmpSatisfaction': 'integer',
+    'LastPerformanceReview_Date': 'date',
+    'Absences': 'integer',
+}
+
+
+# strip and collapse repeated whitespace in a text column
+def normalize_text(column):
+    return column.str.strip().str.replace(r'\s+', ' ', regex=True)
+
+
+# date formats found in the employee csvs: data.csv writes 2015-03-30 (with a time on termination dates), and
+# HRDataset_v14.csv writes 3/30/2015, with two-digit years for birth dates
+DATE_FORMATS = ['%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%m/%d/%Y', '%m/%d/%y']
+
+
+# `values` parsed as dates with the first of DATE_FORMATS each one matches; anything else becomes NaT
+def parse_dates(values):
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    for date_format in DATE_FORMATS:
+        missing = parsed.isna() & values.notna()
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(values[missing], format=date_format, errors='coerce')
+    return parsed
+
+
+# read the employee csv into a typed, compact DataFrame following EMPLOYEE_SCHEMA
+def load_employees(path):
+    # text and dates are read as strings and converted below, numbers are parsed directly
+    raw_dtypes = {column: str for column, kind in EMPLOYEE_SCHEMA.items() if kind in ('text', 'category', 'date')}
+    frame = pd.read_csv(path, usecols=list(EMPLOYEE_SCHEMA), dtype=raw_dtypes)
+
+    for column, kind in EMPLOYEE_SCHEMA.items():
+        if kind in ('text', 'category'):
+            frame[column] = normalize_text(frame[column]).astype('category')
+        elif kind == 'date':
+            # missing dates such as 'N/A' for employees still employed become NaT
+            frame[column] = parse_dates(frame[column])
+        elif kind == 'integer':
+            frame[column] = pd.to_numeric(frame[column], downcast='integer')
+        elif kind == 'float':
+            frame[column] = pd.to_numeric(frame[column], downcast='float')
+
+    # two-digit birth years (HRDataset_v14.csv writes 07/10/83) below 69 are read into the wrong century
+    frame['DOB'] = frame['DOB'].mask(frame['DOB'] > pd.Timestamp.today(), frame['DOB'] - pd.DateOffset(years=100))
+    return frame[list(EMPLOYEE_SCHEMA)]
+
+
+# %% [markdown]
+# ### Columnar Data Cache
+#
+# Parsing the csv dominates worker start-up. The first worker to load a csv writes the typed table next to it as one
+# `.npy` file per column (category and text columns as integer codes plus their categories), and every later worker
+# memory-maps those files, so all workers share the same physical pages through the OS page cache. A small pointer file
+# records the csv's mtime, size and sha256: a touched but unchanged csv is recognized by its hash, a changed one is
+# re-parsed.
+
+# %%
+# bump when the on-disk layout changes so older caches are rebuilt
+CACHE_FORMAT_VERSION = 1
+
+
+# sha256 of a file, read in chunks
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# directory holding the column caches for `path`, e.g. data/.cache for data/data.csv
+def cache_root(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), '.cache')
+
+
+# point the cache of `path` at `directory`, recording the csv's current mtime, size and digest
+def write_cache_pointer(path, directory, digest):
+    root = cache_root(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    stat = os.stat(path)
+    pointer = {'version': CACHE_FORMAT_VERSION, 'schema': EMPLOYEE_SCHEMA, 'directory': os.path.basename(directory),
+               'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': digest}
+    # the pointer is swapped atomically so readers never see a half-written one
+    fd, staging = tempfile.mkstemp(prefix=f'.{stem}-', suffix='.json', dir=root)
+    with os.fdopen(fd, 'w') as file:
+        json.dump(pointer, file)
+    os.replace(staging, os.path.join(root, f'{stem}.json'))
+
+
+# write `frame` as one .npy file per column into a fresh directory named after the csv digest
+def write_column_cache(frame, path, digest):
+    root = cache_root(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    directory = os.path.join(root, f'{stem}-{digest[:16]}')
+    os.makedirs(root, exist_ok=True)
+
+    if not os.path.isdir(directory):
+        staging = tempfile.mkdtemp(prefix=f'.{stem}-', dir=root)
+        kinds = {}
+        for column, kind in EMPLOYEE_SCHEMA.items():
+            kinds[column] = kind
+            values = frame[column]
+            if kind in ('category', 'text'):
+                # categories keep their order, which is the order groupby reports them in
+                values = values.astype('category')
+                np.save(os.path.join(staging, f'{column}.npy'), values.cat.codes.to_numpy())
+                np.save(os.path.join(staging, f'{column}.categories.npy'), np.asarray(values.cat.categories, dtype=str))
+            elif kind == 'date':
+                np.save(os.path.join(staging, f'{column}.npy'), values.to_numpy('datetime64[ns]'))
+            else:
+                np.save(os.path.join(staging, f'{column}.npy'), values.to_numpy())
+        with open(os.path.join(staging, 'columns.json'), 'w') as file:
+            json.dump(kinds, file)
+        try:
+            os.rename(staging, directory)
+        except OSError:
+            # another worker finished the same cache first
+            shutil.rmtree(staging, ignore_errors=True)
+
+    write_cache_pointer(path, directory, digest)
+
+    # drop caches of older versions of this csv, leaving those of other csvs whose names start the same
+    for entry in os.listdir(root):
+        if re.fullmatch(rf'{re.escape(stem)}-[0-9a-f]{{16}}', entry) and entry != os.path.basename(directory):
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+    return directory
+
+
+# memory-map a column cache written by write_column_cache back into a DataFrame
+def read_column_cache(directory):
+    with open(os.path.join(directory, 'columns.json')) as file:
+        kinds = json.load(file)
+    columns = {}
+    for column, kind in kinds.items():
+        values = np.load(os.path.join(directory, f'{column}.npy'), mmap_mode='r')
+        if kind in ('category', 'text'):
+            categories = np.load(os.path.join(directory, f'{column}.categories.npy')).astype(object)
+            # the codes stay memory-mapped; only the distinct values are held by each worker
+            values = pd.Categorical.from_codes(values, categories=categories)
+        columns[column] = values
+    return pd.DataFrame(columns, copy=False)
+
+
+# the csv at `path` as a typed DataFrame, memory-mapped from the column cache when it is up to date
+def load_cached_employees(path):
+    root = cache_root(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    stat = os.stat(path)
+
+    pointer = None
+    try:
+        with open(os.path.join(root, f'{stem}.json')) as file:
+            pointer = json.load(file)
+    except (OSError, ValueError):
+        pass
+    if pointer and (pointer.get('version') != CACHE_FORMAT_VERSION or pointer.get('schema') != EMPLOYEE_SCHEMA):
+        pointer = None
+
+    digest = None
+    if pointer:
+        directory = os.path.join(root, pointer['directory'])
+        unchanged = (pointer['mtime_ns'], pointer['size']) == (stat.st_mtime_ns, stat.st_size)
+        if not unchanged and pointer['size'] == stat.st_size:
+            # touched but possibly unchanged, so compare contents
+            digest = file_digest(path)
+            unchanged = digest == pointer['sha256']
+        if unchanged and os.path.isdir(directory):
+            if pointer['mtime_ns'] != stat.st_mtime_ns:
+                try:
+                    write_cache_pointer(path, directory, digest)
+                except OSError:
+                    pass
+            frame = read_column_cache(directory)
+            frame.attrs['version'] = pointer['sha256']
+            return frame
+
+    frame = load_employees(path)
+    digest = digest or file_digest(path)
+    try:
+        frame = read_column_cache(write_column_cache(frame, path, digest))
+    except OSError:
+        # read-only data directory, serve the parsed frame without a cache
+        pass
+    # the csv digest identifies this version of the data in figure cache keys
+    frame.attrs['version'] = digest
+    return frame
+
+
+# %%
+# the employee csv, data/data.csv unless HR_DATA_PATH points elsewhere (the benchmarks load synthetic data this way)
+DATA_PATH = os.environ.get('HR_DATA_PATH', 'data/data.csv')
+
+
+# the datasets listed in `text` as name=path pairs separated by commas, by name; empty entries (a trailing comma) are
+# skipped
+def parse_datasets(text):
+    datasets = {}
+    for entry in text.split(','):
+        if not entry.strip():
+            continue
+        name, separator, path = (part.strip() for part in entry.partition('='))
+        if not separator or not name or not path:
+            raise ValueError(f'HR_DATASETS entry {entry.strip()!r} is not of the form name=path')
+        datasets[name] = path
+    if not datasets:
+        raise ValueError('HR_DATASETS names no dataset')
+    return datasets
+
+
+# every dataset served, as name=path pairs separated by commas; the first is the default (see Dataset Routing)
+DATASETS = parse_datasets(os.environ.get('HR_DATASETS', f'data={DATA_PATH}'))
+DEFAULT_DATASET = next(iter(DATASETS))
+
+#read in the dataset and then see first five rows of the dataframe df
+df = load_cached_employees(DATASETS[DEFAULT_DATASET])
+df.head()
+
+# %% [markdown]
+# ### Coding UI and Graph Components
+
+# %% [markdown]
+# (1) UI Components:
+# Dropdown menus for each of the following components:
+# - `Department`
+# - `Position`
+# - `Performance Scores`
+# - `Gender`
+# - `Employment Status`
+# 
+# Sliders that allows the user to select:
+# - `Salary Range`
+# - `Age Range`
+# - `Employee Satisfaction`
+# 
+# Date Range Selector that allows a start and end date for all visuals in the dashboard
+# - `Start Date`
+# - `End Date`
+#  
+# 
+# (2) Write Callback functions for the widgets to interact with the graphs
+# 
+# Layout:
+# - Use a stylesheet
+# - There should be a title at the top of the page
+# - There should be a description of the data and app below the title (3-5 sentences)
+# 
+
+# %%
+# calculate age correctly (DOB is already parsed by load_employees)
+def employee_ages(dob, today):
+    age = today.year - dob.dt.year
+    # adjusting for whether the birthday has happened this year
+    age -= ((today.month < dob.dt.month) | ((today.month == dob.dt.month) & (today.day < dob.dt.day))).astype(int)
+    return pd.to_numeric(age, downcast='integer')
+
+
+today = pd.to_datetime('today')
+df['Age'] = employee_ages(df['DOB'], today)
+
+# %%
+# slider labels for the salary, age and satisfaction filters, from the employees in `frame`
+def slider_marks(frame):
+    # set the minimum salary for the slider
+    salary_min = frame['Salary'].min()
+    # set the maximum salary for the slider
+    salary_max = frame['Salary'].max()
+    # finding a representative middle value for user friendliness in the slider
+    salary_mid = round((salary_min + salary_max) / 2 / 1000) * 1000  
+
+    # labelling on the slider
+    salary_marks = {
+        int(salary_min): f'${int(salary_min):,}',
+        int(salary_mid): f'${int(salary_mid):,}',
+        int(salary_max): f'${int(salary_max):,}'
+    }
+
+    # set the minimum age for the slider
+    age_min = frame['Age'].min()
+    # set the maximum salary for the slider
+    age_max = frame['Age'].max()
+    # finding a representative middle value for user friendliness in the slider
+    age_mid = round((age_min + age_max) / 2 / 10) * 10
+
+    # labelling on the slider
+    age_marks = {
+        int(age_min): f'{int(age_min)} yrs',
+        int(age_mid): f'{int(age_mid)} yrs',
+        int(age_max): f'{int(age_max)} yrs'
+    }
+
+    # correcting marks for EmpSatisfaction slider to ensure keys are Python integers
+    satisfaction_marks = {int(satisfaction): str(satisfaction) for satisfaction in sorted(frame['EmpSatisfaction'].unique())}
+    return salary_marks, age_marks, satisfaction_marks
+
+# %% [markdown]
+# ### Callback Instrumentation
+#
+# Setting `HR_METRICS=1` times every callback and the phases inside it: filtering the rows, aggregating them, building the
+# figure and serializing the response. The most recent timings per callback and phase are kept for p50/p95/p99 and
+# published in the Prometheus text format at `/metrics`. With `HR_PROFILE_SLOW_MS` set as well, each request is run
+# under cProfile and the profile of any request slower than that is written to `HR_PROFILE_DIR`.
+
+# %%
+METRICS_ENABLED = os.environ.get('HR_METRICS') == '1'
+
+# timings kept per callback and phase for the percentiles
+METRICS_WINDOW = int(os.environ.get('HR_METRICS_WINDOW', 1024))
+METRICS_QUANTILES = (0.5, 0.95, 0.99)
+
+# requests slower than this many milliseconds leave a .prof file behind (0 turns profiling off)
+PROFILE_SLOW_MS = float(os.environ.get('HR_PROFILE_SLOW_MS', 0))
+PROFILE_DIR = os.environ.get('HR_PROFILE_DIR', 'profiles')
+
+
+class CallbackMetrics:
+    def __init__(self, window):
+        self.window = window
+        self.samples = {}
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def observe(self, callback, phase_name, seconds):
+        key = (callback, phase_name)
+        with self.lock:
+            if key not in self.samples:
+                self.samples[key] = deque(maxlen=self.window)
+                self.totals[key] = [0, 0.0]
+            self.samples[key].append(seconds)
+            self.totals[key][0] += 1
+            self.totals[key][1] += seconds
+
+    # quantiles over the recent window, with the all-time count and sum, per (callback, phase)
+    def summaries(self):
+        with self.lock:
+            snapshot = {key: (np.array(samples), *self.totals[key]) for key, samples in self.samples.items()}
+        return {
+            key: (dict(zip(METRICS_QUANTILES, np.quantile(samples, METRICS_QUANTILES))), count, total)
+            for key, (samples, count, total) in sorted(snapshot.items())
+        }
+
+
+callback_metrics = CallbackMetrics(METRICS_WINDOW)
+
+
+# per-thread timings of the callback being run
+class _CallbackTimings(threading.local):
+    callback = None
+    phases = None
+    active = None
+    elapsed = 0.0
+
+
+_timings = _CallbackTimings()
+
+
+# time the enclosed block as `name` within the current callback; phases do not nest, the outermost one counts
+@contextmanager
+def phase(name):
+    timings = _timings.phases
+    if timings is None or _timings.active is not None:
+        yield
+        return
+    _timings.active = name
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+        _timings.active = None
+
+
+# record the run time of a callback function and of the phases inside it; a no-op unless metrics are on
+def instrumented(func):
+    if not METRICS_ENABLED:
+        return func
+
+    @wraps(func)
+    def timed(*args, **kwargs):
+        _timings.callback, _timings.phases, _timings.active = func.__name__, {}, None
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _timings.elapsed = time.perf_counter() - start
+            for name, seconds in _timings.phases.items():
+                callback_metrics.observe(func.__name__, name, seconds)
+            _timings.phases = None
+
+    return timed
+
+
+# Dash's handler for one callback, timed as a whole; what the handler spends beyond the callback function is serialization
+def timed_dispatch(dispatch):
+    @wraps(dispatch)
+    def timed(*args, **kwargs):
+        _timings.callback, _timings.elapsed = None, 0.0
+        profiler = cProfile.Profile() if PROFILE_SLOW_MS > 0 else None
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                try:
+                    profiler.enable()
+                except ValueError:
+                    # another profiler is already running on this interpreter
+                    profiler = None
+            return dispatch(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            total = time.perf_counter() - start
+            callback = _timings.callback
+            if callback is not None:
+                callback_metrics.observe(callback, 'serialize', max(total - _timings.elapsed, 0.0))
+                callback_metrics.observe(callback, 'total', total)
+                if profiler is not None and total * 1000 >= PROFILE_SLOW_MS:
+                    os.makedirs(PROFILE_DIR, exist_ok=True)
+                    profiler.dump_stats(os.path.join(PROFILE_DIR, f'{callback}-{time.time_ns()}.prof'))
+
+    return timed
+
+
+# a label value escaped for the Prometheus text format
+def metric_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# callback latencies and cache counters in the Prometheus text format; `caches` maps (dataset, cache name) to a memo
+def metrics_text(caches, counters=()):
+    lines = [
+        '# HELP hr_callback_seconds Callback latency by phase; quantiles over the most recent calls.',
+        '# TYPE hr_callback_seconds summary',
+    ]
+    for (callback, phase_name), (quantiles, count, total) in callback_metrics.summaries().items():
+        labels = f'callback="{metric_label(callback)}",phase="{metric_label(phase_name)}"'
+        for quantile, seconds in quantiles.items():
+            lines.append(f'hr_callback_seconds{{{labels},quantile="{quantile}"}} {seconds:.6f}')
+        lines.append(f'hr_callback_seconds_sum{{{labels}}} {total:.6f}')
+        lines.append(f'hr_callback_seconds_count{{{labels}}} {count}')
+
+    for metric, kind, description in [('hits', 'counter', 'Cache lookups answered from the cache.'),
+                                      ('misses', 'counter', 'Cache lookups that had to compute the value.'),
+                                      ('coalesced', 'counter', 'Cache lookups that waited for the same value being computed.'),
+                                      ('size', 'gauge', 'Entries held in memory.')]:
+        name = f'hr_cache_{metric}_total' if kind == 'counter' else f'hr_cache_{metric}'
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+        for (dataset, cache), memo in caches.items():
+            lines.append(f'{name}{{dataset="{metric_label(dataset)}",cache="{metric_label(cache)}"}} {memo.stats()[metric]}')
+
+    for name, description, value in counters:
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} counter', f'{name} {value}']
+    return '\n'.join(lines) + '\n'
+
+# %% [markdown]
+# ### Shared Filter Engine
+#
+# Every callback receives the same filter inputs. Instead of each callback copying `df` and re-running the filter chain,
+# the inputs are normalized into a hashable `FilterSpec`, the matching rows are computed once by `apply_filters`, and the
+# resulting row positions are memoized so the other callbacks fired by the same interaction reuse them. Positions are
+# kept as int32, and the memo is bounded by the bytes it holds rather than by its number of entries, since one entry of a
+# broad filter over millions of employees is as large as thousands of narrow ones.
+
+# %%
+# megabytes of matching row positions kept in memory per dataset
+FILTER_MEMO_MB = float(os.environ.get('HR_FILTER_MEMO_MB', 64))
+
+
+@dataclass(frozen=True)
+class FilterSpec:
+    department: tuple = None
+    position: tuple = None
+    performance: tuple = None
+    gender: str = None
+    employment_status: tuple = None
+    salary_range: tuple = None
+    age_range: tuple = None
+    satisfaction: tuple = None
+    start_date: str = None
+    end_date: str = None
+
+    @classmethod
+    def from_inputs(cls, department=None, position=None, performance=None, gender=None, employment_status=None,
+                    salary_range=None, age_range=None, satisfaction=None, start_date=None, end_date=None):
+        # empty selections mean "no filter", and multi-selects are sorted so the order of picking does not matter
+        def _values(selected):
+            return tuple(sorted(selected)) if selected else None
+
+        def _range(selected):
+            return (selected[0], selected[1]) if selected else None
+
+        # a date range only applies once both ends are picked
+        if not (start_date and end_date):
+            start_date, end_date = None, None
+
+        return cls(
+            department=_values(department),
+            position=_values(position),
+            performance=_values(performance),
+            gender=gender or None,
+            employment_status=_values(employment_status),
+            salary_range=_range(salary_range),
+            age_range=_range(age_range),
+            satisfaction=_values(satisfaction),
+            start_date=start_date,
+            end_date=end_date,
+        )
+
+
+# %% [markdown]
+# ### Categorical Bitmap Index
+#
+# The dropdown and checklist filters select rows by category value. At load time each value of the indexed columns is
+# mapped to a packed row bitset, so a multi-select filter becomes a bitwise OR of a few bitsets and combining filters
+# becomes a bitwise AND, instead of a string scan over the whole column.
+
+# %%
+# columns whose values are precomputed into row bitsets
+INDEXED_COLUMNS = ['Department', 'Position', 'PerformanceScore', 'Sex', 'EmploymentStatus', 'RecruitmentSource',
+                   'ManagerName', 'EmpSatisfaction']
+
+
+class CategoryIndex:
+    def __init__(self, frame, columns):
+        self.n_rows = len(frame)
+        self.bitmaps = {}
+        self.complete = {}
+        for column in columns:
+            codes, values = pd.factorize(frame[column])
+            self.bitmaps[column] = {value: np.packbits(codes == code) for code, value in enumerate(values.tolist())}
+            # whether every row has a value, so selecting every value is the same as no filter
+            self.complete[column] = bool((codes >= 0).all())
+
+    # bitset of rows whose `column` is any of `values`
+    def rows_in(self, column, values):
+        bitmaps = self.bitmaps[column]
+        bits = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+        for value in values:
+            if value in bitmaps:
+                bits |= bitmaps[value]
+        return bits
+
+    # boolean row mask for a bitset
+    def to_mask(self, bits):
+        return np.unpackbits(bits, count=self.n_rows).view(bool)
+
+    # a copy of this index for `frame`, in which only the rows at positions `rows` changed or were appended
+    def updated(self, frame, rows):
+        index = copy.copy(self)
+        index.n_rows = len(frame)
+        index.bitmaps = {}
+        index.complete = {}
+        n_bytes = (index.n_rows + 7) // 8
+        row_bytes, row_bits = rows >> 3, (128 >> (rows & 7)).astype(np.uint8)
+        for column, bitmaps in self.bitmaps.items():
+            # the rows are cleared from every bitmap, then set again under their new values
+            column_bitmaps = {}
+            for value, bits in bitmaps.items():
+                grown = np.zeros(n_bytes, dtype=np.uint8)
+                grown[:len(bits)] = bits
+                np.bitwise_and.at(grown, row_bytes, ~row_bits)
+                column_bitmaps[value] = grown
+            values = frame[column].take(rows)
+            for value in values.dropna().unique().tolist():
+                hit = (values == value).to_numpy()
+                bits = column_bitmaps.setdefault(value, np.zeros(n_bytes, dtype=np.uint8))
+                np.bitwise_or.at(bits, row_bytes[hit], row_bits[hit])
+            # values no row has any more are dropped, so selecting every value still reads as no filter
+            index.bitmaps[column] = {value: bits for value, bits in column_bitmaps.items() if bits.any()}
+            index.complete[column] = bool(frame[column].notna().all())
+        return index
+
+
+# %% [markdown]
+# ### Sorted Range Index
+#
+# The salary, age and hire date filters select a range of values. Each of these columns is argsorted once at load, so a
+# range query is two binary searches that resolve to a contiguous slice of row ids. The narrowest active slice drives
+# the query and the remaining range and category filters are checked only on the rows in that slice.
+
+# %%
+# columns that are argsorted for range queries
+RANGE_COLUMNS = ['Salary', 'Age', 'DateofHire']
+
+
+# comparable numeric values for a column, with dates as nanosecond timestamps
+def range_values(column):
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return column.to_numpy('datetime64[ns]').view('int64')
+    return column.to_numpy()
+
+
+# comparable numeric value for a range bound
+def range_bound(column, bound):
+    if column == 'DateofHire':
+        return pd.Timestamp(bound).value
+    return bound
+
+
+class SortedRangeIndex:
+    def __init__(self, frame, columns):
+        self.n_rows = len(frame)
+        self.values = {}
+        self.order = {}
+        self.sorted_values = {}
+        for column in columns:
+            values = range_values(frame[column])
+            order = np.argsort(values, kind='stable')
+            self.values[column] = values
+            self.order[column] = order
+            self.sorted_values[column] = values[order]
+
+    # (start, stop) bounds of the slice of sorted rows whose `column` lies in [low, high]
+    def slice_between(self, column, low, high):
+        sorted_values = self.sorted_values[column]
+        start = np.searchsorted(sorted_values, range_bound(column, low), side='left')
+        stop = np.searchsorted(sorted_values, range_bound(column, high), side='right')
+        return start, stop
+
+    # row ids in the slice returned by `slice_between`, in sorted-value order
+    def rows_in_slice(self, column, start, stop):
+        return self.order[column][start:stop]
+
+    # which of `rows` have `column` in [low, high]
+    def contains(self, column, rows, low, high):
+        values = self.values[column][rows]
+        return (values >= range_bound(column, low)) & (values <= range_bound(column, high))
+
+    # a copy of this index for `frame`, in which only the rows at positions `rows` changed or were appended
+    def updated(self, frame, rows):
+        index = copy.copy(self)
+        index.n_rows = len(frame)
+        index.values = {}
+        index.order = {}
+        index.sorted_values = {}
+        for column in self.values:
+            values = range_values(frame[column])
+            # the rows leave the sorted order and are merged back in under their new values, without a full sort
+            keep = ~np.isin(self.order[column], rows)
+            order = self.order[column][keep]
+            sorted_values = self.sorted_values[column][keep]
+            moved = rows[np.argsort(values[rows], kind='stable')]
+            at = np.searchsorted(sorted_values, values[moved], side='right')
+            index.values[column] = values
+            index.order[column] = np.insert(order, at, moved)
+            index.sorted_values[column] = np.insert(sorted_values, at, values[moved])
+        return index
+
+
+# whether the rows at positions `rows` are set in a packed bitset
+def bits_at(bits, rows):
+    return ((bits[rows >> 3] >> (7 - (rows & 7))) & 1).astype(bool)
+
+
+# sorted row positions in `frame` matching `spec`, using the category and range indexes built for it
+def apply_filters(frame, spec, categories, ranges):
+    category_filters = [
+        ('Department', spec.department),
+        ('Position', spec.position),
+        ('PerformanceScore', spec.performance),
+        ('Sex', (spec.gender,) if spec.gender else None),
+        ('EmploymentStatus', spec.employment_status),
+        ('EmpSatisfaction', spec.satisfaction),
+    ]
+    bits = None
+    for column, values in category_filters:
+        if values:
+            column_bits = categories.rows_in(column, values)
+            bits = column_bits if bits is None else bits & column_bits
+
+    range_filters = [('Salary', spec.salary_range), ('Age', spec.age_range)]
+    if spec.start_date and spec.end_date:
+        range_filters.append(('DateofHire', (spec.start_date, spec.end_date)))
+
+    # resolve every range to a slice, skipping ranges that cover the whole table
+    slices = []
+    for column, bounds in range_filters:
+        if bounds:
+            start, stop = ranges.slice_between(column, *bounds)
+            if stop - start < len(frame):
+                slices.append((stop - start, column, bounds, start, stop))
+
+    if not slices:
+        if bits is None:
+            return np.arange(len(frame))
+        return np.flatnonzero(categories.to_mask(bits))
+
+    # the narrowest slice drives the query and everything else is checked on its rows only
+    slices.sort(key=lambda item: item[0])
+    _, column, _, start, stop = slices[0]
+    rows = ranges.rows_in_slice(column, start, stop)
+    for _, column, bounds, _, _ in slices[1:]:
+        rows = rows[ranges.contains(column, rows, *bounds)]
+    if bits is not None:
+        rows = rows[bits_at(bits, rows)]
+    return np.sort(rows)
+
+
+# `spec` with filters that match every row replaced by None, so equivalent filter states share one cache entry
+def canonical_spec(spec):
+    data = snapshot()
+    changes = {}
+    for field, column in [('department', 'Department'), ('position', 'Position'), ('performance', 'PerformanceScore'),
+                          ('employment_status', 'EmploymentStatus'), ('satisfaction', 'EmpSatisfaction')]:
+        values = getattr(spec, field)
+        if values and data.category_index.complete[column] and set(values) >= set(data.category_index.bitmaps[column]):
+            changes[field] = None
+
+    # a range covering the lowest and highest value is no filter (missing values sort outside any range)
+    for field, column in [('salary_range', 'Salary'), ('age_range', 'Age')]:
+        bounds = getattr(spec, field)
+        if bounds:
+            start, stop = data.range_index.slice_between(column, *bounds)
+            if stop - start == data.range_index.n_rows:
+                changes[field] = None
+    if spec.start_date and spec.end_date:
+        start, stop = data.range_index.slice_between('DateofHire', spec.start_date, spec.end_date)
+        if stop - start == data.range_index.n_rows:
+            changes['start_date'] = changes['end_date'] = None
+    return replace(spec, **changes) if changes else spec
+
+# bytes held by a memoized array of row positions (0 for values without a size)
+def value_bytes(value):
+    return getattr(value, 'nbytes', 0)
+
+
+# `rows` as the int32 positions kept in the memos (the tables stay far below 2**31 rows)
+def compact_rows(rows):
+    return np.asarray(rows).astype(np.int32, copy=False)
+
+
+class LRUMemo:
+    # at most `maxsize` entries, and if `maxbytes` is given at most that many bytes of values (see value_bytes); None
+    # leaves that side unbounded
+    def __init__(self, maxsize=None, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # keys being computed right now, and how many lookups waited for one instead of computing it again
+        self.pending = {}
+        self.coalesced = 0
+
+    # the value stored under `key`, computing and storing it with `compute()` on a miss
+    def get_or_compute(self, key, compute):
+        while True:
+            with self.lock:
+                if key in self.entries:
+                    self.hits += 1
+                    self.entries.move_to_end(key)
+                    return self.entries[key]
+                computing = self.pending.get(key)
+                if computing is None:
+                    self.misses += 1
+                    computing = self.pending[key] = threading.Event()
+                    break
+                self.coalesced += 1
+            # the same key is already being computed: wait for it, then look again (and compute it here if that failed)
+            computing.wait()
+
+        try:
+            value = self.compute_missing(key, compute)
+            with self.lock:
+                self.entries[key] = value
+                self.nbytes += value_bytes(value)
+                # a value larger than the whole budget is returned but not kept
+                while self.entries and ((self.maxsize is not None and len(self.entries) > self.maxsize)
+                                        or (self.maxbytes is not None and self.nbytes > self.maxbytes)):
+                    self.nbytes -= value_bytes(self.entries.popitem(last=False)[1])
+            return value
+        finally:
+            with self.lock:
+                del self.pending[key]
+            computing.set()
+
+    # the value for a key that is not in memory
+    def compute_missing(self, key, compute):
+        return compute()
+
+    # forget every entry and reset the counters
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.coalesced = 0
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced, 'size': len(self.entries),
+                    'maxsize': self.maxsize, 'bytes': self.nbytes, 'maxbytes': self.maxbytes}
+
+
+# row positions in `df` matching `spec`, computed once per distinct filter state
+def filter_rows(spec):
+    with phase('filter'), pinned_snapshot() as data:
+        spec = canonical_spec(spec)
+        return current_dataset().filter_memo.get_or_compute((data.version, spec), lambda: compact_rows(apply_filters(data.df, spec, data.category_index, data.range_index)))
+
+
+# the filtered employees for `spec`, optionally with only the given columns
+def filtered_employees(spec, columns=None):
+    with phase('filter'), pinned_snapshot() as data:
+        rows = filter_rows(spec)
+        if columns is None:
+            return data.df.take(rows)
+        # taking column by column avoids copying the columns that are not needed
+        return pd.DataFrame({column: data.df[column].take(rows) for column in columns})
+
+# %% [markdown]
+# ### Aggregate Cube
+#
+# The pie, bar and line charts and the average salary only need totals, so at load the employees are rolled up into a
+# cube: one cell per observed combination of the filter dimensions, the recruitment source and salary, age and hire-date
+# buckets, holding the headcount and the count, sum and sum of squares of each measure. A filter state is answered by
+# picking and summing cells, which costs the same for a thousand employees as for ten million. Range filters are
+# answered from the cube when no cell straddles a bound; otherwise the charts fall back to the matching rows.
+
+# %%
+AGGREGATE_CUBE_ENABLED = os.environ.get('HR_AGGREGATE_CUBE', '1') == '1'
+
+CUBE_DIMENSIONS = ['Department', 'Position', 'PerformanceScore', 'Sex', 'EmploymentStatus', 'EmpSatisfaction',
+                   'RecruitmentSource']
+CUBE_MEASURES = ['Salary', 'EmpSatisfaction', 'Absences']
+
+# width of the age buckets in years; salaries are bucketed like the line chart and hire dates by year
+CUBE_AGE_BUCKET = 10
+
+
+# salary rounded to the nearest $10,000, the line chart's x axis and the cube's salary bucket
+def salary_rounded(salary):
+    return (np.round(salary / 10000) * 10000).astype(int)
+
+
+# how each cell summarizes its employees, as pandas named aggregations over the columns from `cube_columns`
+CUBE_AGGREGATIONS = {'count': ('row', 'size'), 'first': ('row', 'min')}
+for measure in CUBE_MEASURES:
+    CUBE_AGGREGATIONS[f'{measure}_n'] = (f'{measure}_value', 'count')
+    CUBE_AGGREGATIONS[f'{measure}_sum'] = (f'{measure}_value', 'sum')
+    CUBE_AGGREGATIONS[f'{measure}_sumsq'] = (f'{measure}_square', 'sum')
+# the extent of every range column inside a cell tells whether a range filter cuts through it
+for column in RANGE_COLUMNS:
+    CUBE_AGGREGATIONS[f'{column}_min'] = (f'{column}_bound', 'min')
+    CUBE_AGGREGATIONS[f'{column}_max'] = (f'{column}_bound', 'max')
+
+
+# the cell keys and the values to aggregate for the employees in `frame`
+def cube_columns(frame):
+    keys = {column: frame[column] for column in CUBE_DIMENSIONS}
+    keys['SalaryRounded'] = salary_rounded(frame['Salary'])
+    keys['AgeBucket'] = frame['Age'] // CUBE_AGE_BUCKET
+    keys['HireYear'] = frame['DateofHire'].dt.year
+
+    values = {}
+    for measure in CUBE_MEASURES:
+        measure_values = frame[measure].to_numpy()
+        values[f'{measure}_value'] = measure_values
+        values[f'{measure}_square'] = measure_values.astype(float) ** 2
+    for column in RANGE_COLUMNS:
+        values[f'{column}_bound'] = range_values(frame[column])
+    return keys, values
+
+
+# a hashable cell key, with missing values as None so that they compare equal
+def cell_key(values):
+    return tuple(None if pd.isna(value) else value for value in values)
+
+
+class AggregateCube:
+    def __init__(self, frame):
+        keys, values = cube_columns(frame)
+        grouped = pd.DataFrame(dict(keys, **values, row=np.arange(len(frame))), copy=False).groupby(
+            list(keys), observed=True, dropna=False, sort=True)
+        self.cells = grouped.agg(**CUBE_AGGREGATIONS).reset_index()
+        # the cell of every employee, so that an update only re-aggregates the cells it touches
+        self.cell_of_row = grouped.ngroup().to_numpy()
+
+    # a copy of this cube for `frame`, in which only the rows at positions `rows` changed or were appended
+    def updated(self, frame, rows):
+        cube = copy.copy(self)
+        keys, _ = cube_columns(frame.take(rows).reset_index(drop=True))
+        key_columns = list(keys)
+        cell_ids = {cell_key(values): cell for cell, values in enumerate(zip(*(self.cells[column] for column in key_columns)))}
+
+        # the touched rows move to the cells of their new keys, new keys open new cells
+        added = []
+        moved_to = np.empty(len(rows), dtype=np.int64)
+        for position, key in enumerate(map(cell_key, zip(*keys.values()))):
+            if key not in cell_ids:
+                cell_ids[key] = len(cell_ids)
+                added.append(key)
+            moved_to[position] = cell_ids[key]
+        cell_of_row = np.full(len(frame), -1, dtype=np.int64)
+        cell_of_row[:len(self.cell_of_row)] = self.cell_of_row
+        left = cell_of_row[rows[rows < len(self.cell_of_row)]]
+        cell_of_row[rows] = moved_to
+
+        cells = self.cells.copy()
+        if added:
+            opened = pd.DataFrame(added, columns=key_columns)
+            for column in CUBE_AGGREGATIONS:
+                opened[column] = np.zeros(len(added), dtype=cells[column].dtype)
+            cells = pd.concat([cells, opened], ignore_index=True)
+        for column in CUBE_DIMENSIONS:
+            if isinstance(frame[column].dtype, pd.CategoricalDtype):
+                # the frame's categories may have grown
+                cells[column] = pd.Categorical(cells[column].astype(object), categories=frame[column].cat.categories)
+
+        # every cell that gained or lost employees is summarized again from its rows, and one left empty counts zero
+        affected = np.unique(np.concatenate([moved_to, left]))
+        members = np.flatnonzero(np.isin(cell_of_row, affected))
+        _, values = cube_columns(frame.take(members).reset_index(drop=True))
+        fresh = pd.DataFrame(dict(values, cell=cell_of_row[members], row=members)).groupby('cell').agg(**CUBE_AGGREGATIONS)
+        for column in CUBE_AGGREGATIONS:
+            summary = cells[column].to_numpy()
+            summary = summary.astype(np.result_type(summary.dtype, fresh[column].dtype))
+            if column == 'count':
+                summary[affected] = 0
+            summary[fresh.index.to_numpy()] = fresh[column].to_numpy()
+            cells[column] = summary
+
+        # cells left without employees are dropped and the rest renumbered
+        keep = cells['count'].to_numpy() > 0
+        cube.cells = cells[keep].reset_index(drop=True)
+        cube.cell_of_row = (np.cumsum(keep) - 1)[cell_of_row]
+        return cube
+
+    # the cells holding exactly the employees matching `spec`, or None when a range filter cuts through a cell
+    def cells_for(self, spec):
+        cells = self.cells
+        mask = np.ones(len(cells), dtype=bool)
+        for column, values in [('Department', spec.department), ('Position', spec.position),
+                               ('PerformanceScore', spec.performance), ('Sex', (spec.gender,) if spec.gender else None),
+                               ('EmploymentStatus', spec.employment_status), ('EmpSatisfaction', spec.satisfaction)]:
+            if values:
+                mask &= cells[column].isin(values).to_numpy()
+
+        range_filters = [('Salary', spec.salary_range), ('Age', spec.age_range)]
+        if spec.start_date and spec.end_date:
+            range_filters.append(('DateofHire', (spec.start_date, spec.end_date)))
+        for column, bounds in range_filters:
+            if not bounds:
+                continue
+            low, high = range_bound(column, bounds[0]), range_bound(column, bounds[1])
+            lowest, highest = cells[f'{column}_min'].to_numpy(), cells[f'{column}_max'].to_numpy()
+            inside = (lowest >= low) & (highest <= high)
+            # missing values never match a range, like in apply_filters
+            outside = (highest < low) | (lowest > high) | pd.isna(lowest)
+            if (mask & ~inside & ~outside).any():
+                return None
+            mask &= inside
+        return cells[mask]
+
+
+# the cube cells for `spec`, or None when the charts have to read the matching rows instead
+def cube_cells(spec):
+    with phase('filter'), pinned_snapshot() as data:
+        if data.aggregate_cube is None:
+            return None
+        return data.aggregate_cube.cells_for(canonical_spec(spec))
+
+# %% [markdown]
+# ### Hot-Reloading Data Source
+#
+# The employees, their indexes and the cube make up one `EmployeeSnapshot`. In every process serving requests, a
+# background thread started with its first request looks at the csv every `HR_DATA_POLL_SECONDS`, and at the csv files
+# dropped into `HR_DATA_DELTA_DIR/<dataset name>` if `HR_DATA_DELTA_DIR` is set (the name is `data` unless
+# `HR_DATASETS` names the datasets). Lines appended to the csv and delta files are
+# parsed on their own, incoming rows are matched to the current employees by `EmpID`, and only the new and changed rows
+# are written into copies of the indexes and the cube. Ages move on after midnight the same way, for the employees whose
+# birthday it is. Any other change to the csv rebuilds the snapshot from the new file and every delta file, so employees
+# removed from the export go away. The next snapshot is swapped in with one assignment, and each callback pins the
+# snapshot it started with, so a refresh never mixes two versions of the data.
+#
+# The data version is a digest of the csv, the names of the delta files applied and the date the ages are counted at.
+# Every worker that has seen the same files on the same day holds the same data under the same version, whenever it
+# started, so the shared figure directory and restored sessions work across workers.
+
+# %%
+# seconds between looks at the csv and the delta directory (0 turns the watcher off)
+DATA_POLL_SECONDS = float(os.environ.get('HR_DATA_POLL_SECONDS', 10))
+
+# directory with one folder per dataset of csv files with new or changed employees, applied in name order; files should
+# be renamed into place whole
+DATA_DELTA_DIR = os.environ.get('HR_DATA_DELTA_DIR')
+
+logger = logging.getLogger(__name__)
+
+
+# `column` grown to `n_rows` with `values` written at positions `rows`
+def write_rows(column, rows, values, n_rows):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # categories stay sorted, as when the csv is loaded; the existing codes are only recoded when values are new
+        added = pd.Index(values.dropna().unique()).difference(column.cat.categories)
+        categories = column.cat.categories.append(added).sort_values() if len(added) else column.cat.categories
+        codes = np.full(n_rows, -1, dtype=np.int32)
+        codes[:len(column)] = (column.cat.set_categories(categories) if len(added) else column).cat.codes.to_numpy()
+        codes[rows] = pd.Categorical(values, categories=categories).codes
+        return pd.Categorical.from_codes(codes, categories=categories)
+    if pd.api.types.is_datetime64_any_dtype(column):
+        existing, values = column.to_numpy('datetime64[ns]'), pd.to_datetime(values).to_numpy('datetime64[ns]')
+    else:
+        existing, values = column.to_numpy(), values.to_numpy()
+    grown = np.empty(n_rows, dtype=np.result_type(existing.dtype, values.dtype))
+    grown[:len(existing)] = existing
+    grown[rows] = values
+    return grown
+
+
+# `frame` with the employees of `delta` written over the rows with the same EmpID and the others appended,
+# and the positions of the rows that are new or differ
+def upsert_employees(frame, delta):
+    delta = delta.drop_duplicates('EmpID', keep='last').reset_index(drop=True)
+    positions = pd.Series(np.arange(len(frame)), index=frame['EmpID'].to_numpy())
+    positions = positions[~positions.index.duplicated(keep='last')].reindex(delta['EmpID'].to_numpy()).to_numpy()
+    existing = ~np.isnan(positions)
+    at = positions[existing].astype(np.int64)
+
+    # rows that come in unchanged are left alone
+    old = frame.take(at).reset_index(drop=True)
+    new = delta[existing].reset_index(drop=True)
+    differs = np.zeros(len(at), dtype=bool)
+    for column in frame.columns:
+        before, after = old[column].astype(object), new[column].astype(object)
+        differs |= ~((before == after) | (before.isna() & after.isna())).to_numpy()
+
+    appended = delta[~existing]
+    n_rows = len(frame) + len(appended)
+    rows = np.concatenate([at[differs], np.arange(len(frame), n_rows)])
+    if not len(rows):
+        return frame, rows
+    changes = pd.concat([new[differs], appended], ignore_index=True)
+    columns = {column: write_rows(frame[column], rows, changes[column], n_rows) for column in frame.columns}
+    return pd.DataFrame(columns, copy=False), rows
+
+
+# `frame` with ages as of `today`, and the positions of the employees whose age changed
+def aged_employees(frame, today):
+    ages = employee_ages(frame['DOB'], today)
+    changed = np.flatnonzero(~((ages == frame['Age']) | (ages.isna() & frame['Age'].isna())).to_numpy())
+    if not len(changed):
+        return frame, changed
+    columns = {column: ages if column == 'Age' else frame[column] for column in frame.columns}
+    return pd.DataFrame(columns, copy=False), changed
+
+
+class EmployeeSnapshot:
+    def __init__(self, frame, today, categories=None, ranges=None, cube=None, version=None):
+        self.df = frame
+        self.version = version or frame.attrs.get('version')
+        self.today = today
+        self.category_index = categories if categories is not None else CategoryIndex(frame, INDEXED_COLUMNS)
+        self.range_index = ranges if ranges is not None else SortedRangeIndex(frame, RANGE_COLUMNS)
+        if cube is None and AGGREGATE_CUBE_ENABLED:
+            cube = AggregateCube(frame)
+        self.aggregate_cube = cube
+        # values derived from this snapshot on first use (see per_snapshot)
+        self.derived = {}
+
+    # the next snapshot, with ages as of `today` and the employees in `delta` (if any) upserted, as data version `version`
+    def updated(self, delta, today, version):
+        frame, rows = self.df, np.array([], dtype=np.int64)
+        if today != self.today:
+            frame, rows = aged_employees(frame, today)
+        category_rows = np.array([], dtype=np.int64)
+        if delta is not None and len(delta):
+            delta = delta.copy()
+            delta['Age'] = employee_ages(delta['DOB'], today)
+            frame, category_rows = upsert_employees(frame, delta)
+            rows = np.union1d(rows, category_rows)
+        if not len(rows):
+            return EmployeeSnapshot(self.df, today, self.category_index, self.range_index, self.aggregate_cube, version)
+
+        categories = self.category_index.updated(frame, category_rows) if len(category_rows) else self.category_index
+        cube = self.aggregate_cube.updated(frame, rows) if self.aggregate_cube is not None else None
+        return EmployeeSnapshot(frame, today, categories, self.range_index.updated(frame, rows), cube, version)
+
+
+# decorator computing `build(data, *args)` once per snapshot and keeping the result with the snapshot
+def per_snapshot(build):
+    @wraps(build)
+    def cached(data, *args):
+        key = (build.__name__, *args)
+        if key not in data.derived:
+            data.derived[key] = build(data, *args)
+        return data.derived[key]
+    return cached
+
+
+# sha256 of the first `size` bytes of the file at `path` (None if it is shorter) and of the whole file
+def file_digests(path, size):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        remaining = size
+        while remaining > 0:
+            chunk = file.read(min(1 << 20, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+        prefix = digest.hexdigest() if remaining == 0 else None
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return prefix, digest.hexdigest()
+
+
+class DataSource:
+    def __init__(self, path, frame, today, delta_dir=None):
+        self.path = path
+        self.delta_dir = delta_dir
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        # the process whose thread is watching the files, if any
+        self.watcher_pid = None
+        stat = os.stat(path)
+        self.csv_state = (stat.st_mtime_ns, stat.st_size, frame.attrs.get('version'))
+        self.applied_deltas = set()
+        self.current = EmployeeSnapshot(frame, today.normalize(), version=self.version(today.normalize()))
+        # deltas already waiting in the drop directory
+        self.refresh()
+
+    # data version of the csv as last read with the delta files applied so far, with ages as of `today`
+    def version(self, today):
+        digest = hashlib.sha256(self.csv_state[2].encode())
+        for name in sorted(self.applied_deltas):
+            digest.update(b'\0' + name.encode())
+        digest.update(b'\0' + today.strftime('%Y-%m-%d').encode())
+        return digest.hexdigest()
+
+    # the employees of the csv if it changed since the last look, and whether they are only the appended lines
+    def read_csv_changes(self):
+        stat = os.stat(self.path)
+        mtime_ns, size, digest = self.csv_state
+        if (stat.st_mtime_ns, stat.st_size) == (mtime_ns, size):
+            return None
+        prefix, new_digest = file_digests(self.path, size)
+        self.csv_state = (stat.st_mtime_ns, stat.st_size, new_digest)
+        if new_digest == digest:
+            return None
+
+        if prefix == digest and stat.st_size > size:
+            with open(self.path, 'rb') as file:
+                header = file.readline()
+                file.seek(size - 1)
+                tail = file.read()
+            if tail.startswith(b'\n'):
+                return load_employees(io.BytesIO(header + tail[1:])), True
+        return load_cached_employees(self.path), False
+
+    # the employees in delta file `name`, or None when it does not load
+    def read_delta_file(self, name):
+        try:
+            return load_employees(os.path.join(self.delta_dir, name))
+        except (OSError, ValueError, KeyError) as error:
+            logger.warning('skipping employee delta %s: %s', name, error)
+            return None
+
+    # the employees in delta files that have not been applied yet, oldest name first
+    def read_delta_files(self):
+        if not self.delta_dir or not os.path.isdir(self.delta_dir):
+            return []
+        frames = []
+        for name in sorted(os.listdir(self.delta_dir)):
+            if not name.endswith('.csv') or name in self.applied_deltas:
+                continue
+            # a file is tried once, so a broken one is reported instead of failing every refresh
+            self.applied_deltas.add(name)
+            frames.append(self.read_delta_file(name))
+        return [frame for frame in frames if frame is not None]
+
+    # whether appending `tail` to the current employees gives what loading the whole csv afresh would: only when no
+    # delta file came before it and every appended employee is new
+    def appends_cleanly(self, tail, applied_before):
+        ids = tail['EmpID']
+        return not applied_before and not ids.duplicated().any() and not ids.isin(self.current.df['EmpID']).any()
+
+    # a snapshot built from the csv employees `frame` and then every delta file applied so far, in name order
+    def rebuilt(self, frame, today, version):
+        frame['Age'] = employee_ages(frame['DOB'], today)
+        data = EmployeeSnapshot(frame, today, version=version)
+        for name in sorted(self.applied_deltas):
+            delta = self.read_delta_file(name)
+            if delta is not None:
+                data = data.updated(delta, today, version)
+        return data
+
+    # bring the snapshot up to date with the csv, the delta files and today's date; deltas are applied one file at a
+    # time, as a worker starting now would apply them
+    def refresh(self):
+        with self.lock:
+            applied_before = set(self.applied_deltas)
+            csv = self.read_csv_changes()
+            deltas = self.read_delta_files()
+            today = pd.Timestamp.today().normalize()
+            version = self.version(today)
+            if version == self.current.version:
+                return self.current
+
+            if csv is not None and not (csv[1] and self.appends_cleanly(csv[0], applied_before)):
+                frame = csv[0] if not csv[1] else load_cached_employees(self.path)
+                self.current = self.rebuilt(frame, today, version)
+                return self.current
+
+            data = self.current
+            changes = ([csv[0]] if csv is not None else []) + deltas
+            for delta in changes or [None]:
+                data = data.updated(delta, today, version)
+            self.current = data
+            return self.current
+
+    # refresh every `interval` seconds in a background thread of this process, until stopped; threads do not survive a
+    # fork, so a forked process starts its own when asked again
+    def watch(self, interval):
+        with self.lock:
+            if self.watcher_pid == os.getpid() or self.stopped.is_set():
+                return
+            self.watcher_pid = os.getpid()
+
+        def poll():
+            while not self.stopped.wait(interval):
+                try:
+                    self.refresh()
+                except Exception:
+                    # a bad export is logged and the current snapshot keeps serving
+                    logger.exception('refreshing the employee data failed')
+
+        threading.Thread(target=poll, name='employee-data-source', daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+
+
+# the snapshot of the running callback
+class _PinnedSnapshot(threading.local):
+    data = None
+
+
+_pinned = _PinnedSnapshot()
+
+
+# the snapshot pinned by the running callback, or else the latest one
+def snapshot():
+    return _pinned.data if _pinned.data is not None else current_dataset().source.current
+
+
+# pin the latest snapshot for the enclosed block, so that everything in it reads one version of the data
+@contextmanager
+def pinned_snapshot():
+    if _pinned.data is not None:
+        yield _pinned.data
+        return
+    _pinned.data = current_dataset().source.current
+    try:
+        yield _pinned.data
+    finally:
+        _pinned.data = None
+
+# %% [markdown]
+# ### Headcount Engine
+#
+# The headcount chart shows, for every month of the picked date range, how many of the employees matching the other
+# filters were hired, how many left, and how many were active at the month's end. Each snapshot keeps everyone's hire and
+# termination days as two sorted arrays, with the row order that sorts them. The matching rows' days are picked out of
+# those in sorted order, so the running count of either event at a month boundary is one binary search, and a whole
+# chart is a `searchsorted` over the month boundaries instead of a pass over the rows per month.
+
+# %%
+# day number standing in for a missing date
+MISSING_DAY = np.iinfo(np.int64).min
+
+
+# days since 1970-01-01 of a date column, MISSING_DAY where missing
+def day_numbers(dates):
+    days = dates.to_numpy('datetime64[D]')
+    return np.where(np.isnat(days), MISSING_DAY, days.astype(np.int64))
+
+
+class HeadcountIndex:
+    def __init__(self, frame):
+        hired = day_numbers(frame['DateofHire'])
+        terminated = day_numbers(frame['DateofTermination'])
+        self.n_rows = len(frame)
+
+        # employees without a hire date are never counted, so neither is their termination
+        employed = hired != MISSING_DAY
+        left = employed & (terminated != MISSING_DAY)
+        self.hire_order = np.flatnonzero(employed)[np.argsort(hired[employed], kind='stable')]
+        self.hire_days = hired[self.hire_order]
+        self.termination_order = np.flatnonzero(left)[np.argsort(terminated[left], kind='stable')]
+        self.termination_days = terminated[self.termination_order]
+
+    # first and last day with any hire or termination
+    def span(self):
+        if not len(self.hire_days):
+            return None
+        last = max(self.hire_days[-1], self.termination_days[-1] if len(self.termination_days) else MISSING_DAY)
+        return int(self.hire_days[0]), int(last)
+
+    # sorted hire and termination days of the rows at `rows`
+    def events(self, rows):
+        if len(rows) == self.n_rows:
+            return self.hire_days, self.termination_days
+        selected = np.zeros(self.n_rows, dtype=bool)
+        selected[rows] = True
+        return self.hire_days[selected[self.hire_order]], self.termination_days[selected[self.termination_order]]
+
+    # hires and terminations of `rows` between consecutive day `edges`, and their headcount at every edge
+    def counts(self, rows, edges):
+        hires, terminations = self.events(rows)
+        hired_before = np.searchsorted(hires, edges)
+        left_before = np.searchsorted(terminations, edges)
+        return np.diff(hired_before), np.diff(left_before), hired_before - left_before
+
+
+# the headcount index of snapshot `data`, built on first use
+@per_snapshot
+def headcount_index(data):
+    return HeadcountIndex(data.df)
+
+
+# month labels and day edges of the months from `first` to `last` (days), the first and last clipped to them
+def month_edges(first, last):
+    months = np.arange(np.datetime64(first, 'D').astype('datetime64[M]'), np.datetime64(last, 'D').astype('datetime64[M]') + 1)
+    edges = np.append(months.astype('datetime64[D]').astype(np.int64), last + 1)
+    edges[0] = first
+    return np.datetime_as_string(months, unit='M'), edges
+
+# %% [markdown]
+# ### JSON Payloads
+#
+# Dash turns every callback response into JSON with plotly's encoder, which uses `orjson` when it is installed. orjson
+# writes numeric NumPy arrays straight from their buffers, but anything it cannot write (an array of strings, a NumPy
+# scalar, the `Patch` around a figure) sends the whole response through plotly's slow cleaning pass. Cached figures are
+# therefore stored with numeric arrays kept as contiguous arrays and everything else as plain Python values, so that pass
+# only has lists and dicts to walk, and the table page is sent as one list per column instead of one dict per row.
+
+# %%
+# `value` with numeric arrays made contiguous and every other NumPy value turned into plain Python
+def json_ready(value):
+    if isinstance(value, dict):
+        return {key: json_ready(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_ready(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return np.ascontiguousarray(value) if value.dtype.kind in 'biuf' else value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+# the columns of `frame` as {'columns': names, 'data': one list or array per column}, rebuilt into rows in the browser
+def columnar(frame):
+    return {'columns': frame.columns.tolist(), 'data': [json_ready(frame[column].to_numpy()) for column in frame.columns]}
+
+# %% [markdown]
+# ### Server-Side Employee Table
+#
+# The employee table is paged, sorted and filtered on the server. The table's filter query is parsed here and applied to
+# the rows matching the sidebar filters, the result is sorted with a stable multi-key sort, and only the visible page is
+# sent to the browser. The ordered row ids are memoized so paging through a result is a slice.
+
+# %%
+# columns shown in the employee table, in display order
+TABLE_COLUMNS = [
+    {"name": "Employee Name", "id": "Employee_Name"},
+    {"name": "Salary", "id": "Salary"},
+    {"name": "Department", "id": "Department"},
+    {"name": "Manager Name", "id": "ManagerName"},
+    {"name": "Recruitment Source", "id": "RecruitmentSource"},
+    {"name": "Last Performance Review Date", "id": "LastPerformanceReview_Date"},
+    {"name": "Marital Status", "id": "MaritalDesc"},
+    {"name": "Race", "id": "RaceDesc"},
+    {"name": "Date of Birth", "id": "DOB"},
+    {"name": "Absences", "id": "Absences"}
+]
+TABLE_COLUMN_IDS = [column['id'] for column in TABLE_COLUMNS]
+
+# rows per table page
+TABLE_PAGE_SIZE = 25
+
+# megabytes of (filters, table query, sort) row orders kept in memory per dataset
+TABLE_MEMO_MB = float(os.environ.get('HR_TABLE_MEMO_MB', 64))
+
+# one clause of a DataTable filter query, e.g. {Salary} s>= 50000, {Department} icontains sales or {DOB} is blank
+FILTER_CLAUSE = re.compile(
+    r'^\{(?P<column>[^}]+)\}\s*(?P<case>[is]?)(?P<operator>>=|<=|!=|<|>|=|ge|le|lt|gt|ne|eq|contains|datestartswith|is\b)\s*(?P<value>.*)$'
+)
+FILTER_OPERATORS = {'ge': '>=', 'le': '<=', 'lt': '<', 'gt': '>', 'ne': '!=', 'eq': '='}
+
+
+# list of (column, operator, value, case_sensitive) clauses in a DataTable filter query; a clause that does not parse is
+# kept with column None, and matches nothing
+def parse_filter_query(filter_query):
+    clauses = []
+    for part in (filter_query or '').split(' && '):
+        if not part.strip():
+            continue
+        match = FILTER_CLAUSE.match(part.strip())
+        if not match or match['column'] not in TABLE_COLUMN_IDS:
+            clauses.append((None, None, part, True))
+            continue
+        value = match['value'].strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'`':
+            value = value[1:-1]
+        operator = FILTER_OPERATORS.get(match['operator'], match['operator'])
+        clauses.append((match['column'], operator, value, match['case'] != 'i'))
+    return clauses
+
+
+# boolean mask of `values` satisfying `operator value`, where `values` is an array of one type
+def compare(values, operator, value, case_sensitive=True):
+    if operator == 'contains':
+        return pd.Series(values, dtype=object).astype(str).str.contains(value, case=case_sensitive, regex=False).to_numpy()
+    if operator == 'datestartswith':
+        return pd.Series(values, dtype=object).astype(str).str.startswith(value).to_numpy()
+    if operator == '=':
+        return values == value
+    if operator == '!=':
+        return values != value
+    if operator == '>=':
+        return values >= value
+    if operator == '<=':
+        return values <= value
+    if operator == '<':
+        return values < value
+    return values > value
+
+
+# boolean mask of the rows of `column` that are of `kind`, for the DataTable's unary `is blank`, `is num` and so on;
+# dates reach the browser as text
+def kind_mask(column, kind):
+    present = column.notna().to_numpy()
+    numeric = pd.api.types.is_numeric_dtype(column)
+    if kind == 'nil':
+        return ~present
+    if kind == 'blank':
+        if numeric or pd.api.types.is_datetime64_any_dtype(column):
+            return ~present
+        return ~present | (pd.Series(column.to_numpy(), dtype=object).astype(str).str.strip() == '').to_numpy()
+    if kind == 'num':
+        return present if numeric else np.zeros(len(column), dtype=bool)
+    if kind == 'str':
+        return np.zeros(len(column), dtype=bool) if numeric else present
+    if kind == 'bool':
+        return np.zeros(len(column), dtype=bool)
+    if kind in ('even', 'odd'):
+        if not numeric:
+            return np.zeros(len(column), dtype=bool)
+        values = column.to_numpy(dtype=float)
+        whole = present & (values == np.floor(values))
+        return whole & ((np.fmod(values, 2) == 0) == (kind == 'even'))
+    raise ValueError(f'unsupported filter: is {kind}')
+
+
+# boolean mask of the rows of `column` satisfying one parsed filter clause
+def clause_mask(column, operator, value, case_sensitive):
+    if operator == 'is':
+        return kind_mask(column, value)
+    if pd.api.types.is_datetime64_any_dtype(column):
+        if operator == 'datestartswith':
+            # a prefix such as 2015 or 2015-03 covers a whole period
+            period = pd.Period(value)
+            return column.between(period.start_time, period.end_time).to_numpy()
+        if operator == 'contains':
+            return compare(column.dt.strftime('%Y-%m-%d').to_numpy(), operator, value)
+        return compare(column.to_numpy(), operator, pd.Timestamp(value).to_datetime64())
+    if pd.api.types.is_numeric_dtype(column):
+        if operator in ('contains', 'datestartswith'):
+            return compare(column.to_numpy(), operator, value)
+        return compare(column.to_numpy(), operator, pd.to_numeric(value))
+    # categorical columns evaluate the clause once per category instead of once per row
+    categorical = isinstance(column.dtype, pd.CategoricalDtype)
+    values = pd.Series(column.cat.categories if categorical else column.to_numpy(), dtype=object)
+    if not case_sensitive and operator != 'contains':
+        value = value.lower()
+        values = values.str.lower()
+    matches = compare(values.to_numpy(), operator, value, case_sensitive)
+    if categorical:
+        # missing values have code -1, which picks the appended False
+        return np.append(matches, False)[column.cat.codes.to_numpy()]
+    return matches
+
+
+# row positions in `df` for the table: sidebar filters, then the table's own filter query, then its sort order
+def query_table_rows(spec, filter_query, sort_by):
+    give_way_if_superseded()
+    rows = filter_rows(spec)
+    with phase('aggregate'):
+        return compact_rows(narrowed_table_rows(rows, filter_query, sort_by))
+
+
+# `rows` narrowed by the table's filter query and ordered by its sort
+def narrowed_table_rows(rows, filter_query, sort_by):
+    clauses = parse_filter_query(filter_query)
+    sort_by = [item for item in sort_by or [] if item['column_id'] in TABLE_COLUMN_IDS]
+    if not clauses and not sort_by:
+        return rows
+
+    # only the columns the query touches are gathered
+    needed = {column for column, _, _, _ in clauses if column is not None} | {item['column_id'] for item in sort_by}
+    frame = pd.DataFrame({column: snapshot().df[column].take(rows).reset_index(drop=True) for column in needed}, index=pd.RangeIndex(len(rows)))
+
+    keep = np.ones(len(rows), dtype=bool)
+    for column, operator, value, case_sensitive in clauses:
+        try:
+            if column is None:
+                raise ValueError(f'unparsed filter clause: {value}')
+            keep &= clause_mask(frame[column], operator, value, case_sensitive)
+        except (ValueError, TypeError):
+            # a value that does not parse for this column matches nothing
+            keep[:] = False
+    rows = rows[keep]
+    frame = frame[keep]
+
+    if sort_by:
+        order = frame.reset_index(drop=True).sort_values(
+            by=[item['column_id'] for item in sort_by],
+            ascending=[item['direction'] == 'asc' for item in sort_by],
+            kind='mergesort',
+        ).index.to_numpy()
+        rows = rows[order]
+    return rows
+
+
+# ordered row positions of the table in snapshot `data`, memoized
+def table_rows(data, spec, filter_query, sort_by):
+    key = (data.version, canonical_spec(spec), filter_query or '', tuple((item['column_id'], item['direction']) for item in sort_by or []))
+    return current_dataset().table_memo.get_or_compute(key, lambda: query_table_rows(spec, filter_query, sort_by))
+
+
+# the table's columns of snapshot `data` at `rows`, gathered one column at a time so no other column is copied
+def table_frame(data, rows):
+    return pd.DataFrame({column: data.df[column].take(rows) for column in TABLE_COLUMN_IDS})
+
+
+# one page of the table in columnar form and the total number of pages
+def table_page(spec, filter_query, sort_by, page_current, page_size):
+    with pinned_snapshot() as data:
+        rows = table_rows(data, spec, filter_query, sort_by)
+
+        page_size = page_size or TABLE_PAGE_SIZE
+        page_count = max(1, -(-len(rows) // page_size))
+        # a page past the end of a narrower result shows its last page instead
+        page_current = min(page_current or 0, page_count - 1)
+
+        with phase('figure'):
+            page = table_frame(data, rows[page_current * page_size:(page_current + 1) * page_size])
+            page['DOB'] = page['DOB'].dt.strftime('%Y-%m-%d')
+            page['LastPerformanceReview_Date'] = page['LastPerformanceReview_Date'].dt.strftime('%Y-%m-%d')
+            return columnar(page), page_count
+
+# %% [markdown]
+# ### Figure Cache
+#
+# Many users look at the same filter states, the defaults most of all. Finished figures are cached per chart under the
+# canonical filter state in a bounded LRU with hit/miss counters. Setting `HR_FIGURE_CACHE_DIR` to a directory shared by
+# the gunicorn workers also stores every figure there, so one worker's miss becomes every other worker's hit. Each
+# dataset has its own folder in it, pruned to its own number of files.
+
+# %%
+# figures kept in memory per worker
+FIGURE_CACHE_SIZE = int(os.environ.get('HR_FIGURE_CACHE_SIZE', 256))
+
+# optional directory shared by all workers, and how many figures it keeps per dataset
+FIGURE_CACHE_DIR = os.environ.get('HR_FIGURE_CACHE_DIR')
+FIGURE_CACHE_DIR_SIZE = int(os.environ.get('HR_FIGURE_CACHE_DIR_SIZE', 2048))
+
+
+class FigureCache(LRUMemo):
+    def __init__(self, maxsize, directory=None, directory_size=0):
+        super().__init__(maxsize)
+        self.directory = directory
+        self.directory_size = directory_size
+        self.shared_hits = 0
+        # values given back to reloaded pages by digest
+        self.restored = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    # look in the shared directory before building, and share what gets built
+    def compute_missing(self, key, compute):
+        if not self.directory:
+            return compute()
+
+        path = os.path.join(self.directory, result_digest(key) + '.pkl')
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+            with self.lock:
+                self.shared_hits += 1
+            return value
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+
+        value = compute()
+        try:
+            fd, staging = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(staging, path)
+            self.prune()
+        except OSError:
+            pass
+        return value
+
+    # drop the least recently written files beyond the directory's size
+    def prune(self):
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.pkl')]
+        if len(entries) > self.directory_size:
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in entries[:len(entries) - self.directory_size]:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    # the cached values of those `digests` still held in memory or in the shared directory, by digest; anything that is
+    # not a digest is ignored, since digests come from the browser
+    def find(self, digests):
+        wanted = {digest for digest in digests if isinstance(digest, str) and DIGEST_PATTERN.fullmatch(digest)}
+        with self.lock:
+            found = {digest: value for digest, value in ((result_digest(key), value) for key, value in self.entries.items()) if digest in wanted}
+        for digest in wanted - found.keys() if self.directory else ():
+            try:
+                with open(os.path.join(self.directory, digest + '.pkl'), 'rb') as file:
+                    found[digest] = pickle.load(file)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+        with self.lock:
+            self.restored += len(found)
+        return found
+
+    def stats(self):
+        stats = super().stats()
+        stats['shared_hits'] = self.shared_hits
+        return stats
+
+
+# what result_digest returns
+DIGEST_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+# the address of the result cached under `key`, as its file name in the shared directory and in a page's session state
+def result_digest(key):
+    return hashlib.sha256(repr(key).encode()).hexdigest()
+
+
+# charts that use the picked date range as their time window: a range covering every hire is no filter, but still a
+# different window
+WINDOWED_CHARTS = {'headcount-trend'}
+
+
+# cache key of chart `name` for `spec` in snapshot `data`
+def figure_key(name, data, spec):
+    key = name, data.version, canonical_spec(spec)
+    if name in WINDOWED_CHARTS:
+        key += (spec.start_date, spec.end_date)
+    return key
+
+
+# the output of `build(spec)` for chart `name`, built once per canonical filter state and data version
+def cached_figure(name, spec, build):
+    with pinned_snapshot() as data:
+        return current_dataset().figure_cache.get_or_compute(figure_key(name, data, spec), lambda: json_ready(run_build(build, spec, data)))
+
+
+# cache key of one page of the employee table in snapshot `data`
+def table_page_key(data, spec, filter_query, sort_by, page_current, page_size):
+    sort = tuple((item['column_id'], item['direction']) for item in sort_by or [])
+    return 'employee-data-table', data.version, canonical_spec(spec), filter_query or '', sort, page_current or 0, page_size or TABLE_PAGE_SIZE
+
+
+# the table page of `table_page`, cached with the figures so that a reloaded page can be given it back
+def cached_table_page(spec, filter_query, sort_by, page_current, page_size):
+    with pinned_snapshot() as data:
+        key = table_page_key(data, spec, filter_query, sort_by, page_current, page_size)
+        return current_dataset().figure_cache.get_or_compute(key, lambda: table_page(spec, filter_query, sort_by, page_current, page_size))
+
+# %% [markdown]
+# ### Dataset Routing
+#
+# One process can serve several employee datasets, one per business unit, each at its own URL: `HR_DATASETS` lists them
+# as `name=path` pairs (`unit-a=data/data.csv,unit-b=data/HRDataset_v14.csv`), the first is served at `/` and every one
+# at `/<name>`. The first is loaded at start-up and stays loaded; the others are loaded on their first request, each with
+# its own data source, indexes and filter, table and figure caches. When the loaded datasets' tables take more than
+# `HR_DATASET_MEMORY_MB`, the least recently used of the others are unloaded, to be loaded again when next asked for.
+
+# %%
+# total size of the loaded datasets' tables before the least recently used is unloaded (0: no limit)
+DATASET_MEMORY_MB = float(os.environ.get('HR_DATASET_MEMORY_MB', 0))
+
+
+# bytes held by the table of snapshot `data`
+@per_snapshot
+def snapshot_memory(data):
+    return int(data.df.memory_usage(index=False, deep=True).sum())
+
+
+class Dataset:
+    def __init__(self, name, path, frame, today, delta_dir=None):
+        self.name = name
+        self.source = DataSource(path, frame, today, delta_dir)
+        self.filter_memo = LRUMemo(maxbytes=FILTER_MEMO_MB * 2 ** 20)
+        self.table_memo = LRUMemo(maxbytes=TABLE_MEMO_MB * 2 ** 20)
+        # each dataset keeps its figures in its own folder of the shared directory, with its own share of files
+        self.figure_cache = FigureCache(FIGURE_CACHE_SIZE, figure_directory(name), FIGURE_CACHE_DIR_SIZE)
+
+    # keep the data up to date in the running process (see watch_datasets)
+    def watch(self):
+        if DATA_POLL_SECONDS > 0:
+            self.source.watch(DATA_POLL_SECONDS)
+
+    def caches(self):
+        return {'filter': self.filter_memo, 'table': self.table_memo, 'figure': self.figure_cache}
+
+
+# the folder of HR_FIGURE_CACHE_DIR that dataset `name` shares its figures in
+def figure_directory(name):
+    return os.path.join(FIGURE_CACHE_DIR, name) if FIGURE_CACHE_DIR else None
+
+
+# the directory dataset `name` takes delta csvs from: its own folder of HR_DATA_DELTA_DIR, the default one's included
+def delta_directory(name):
+    return os.path.join(DATA_DELTA_DIR, name) if DATA_DELTA_DIR else None
+
+
+class DatasetRegistry:
+    def __init__(self, paths, budget_bytes):
+        self.paths = paths
+        self.budget_bytes = budget_bytes
+        self.loaded = OrderedDict()
+        self.lock = threading.Lock()
+        # held while a dataset loads, so two requests never load the same one twice
+        self.load_lock = threading.Lock()
+        self.evicted = 0
+
+    def add(self, dataset):
+        with self.lock:
+            self.loaded[dataset.name] = dataset
+
+    # the dataset called `name`, loaded on first use; None for a name that is not registered
+    def get(self, name):
+        if name not in self.paths:
+            return None
+        with self.lock:
+            if name in self.loaded:
+                self.loaded.move_to_end(name)
+                return self.loaded[name]
+
+        with self.load_lock:
+            if name in self.loaded:
+                return self.loaded[name]
+            today = pd.to_datetime('today')
+            frame = load_cached_employees(self.paths[name])
+            frame['Age'] = employee_ages(frame['DOB'], today)
+            dataset = Dataset(name, self.paths[name], frame, today, delta_directory(name))
+            with self.lock:
+                self.loaded[name] = dataset
+                self.evict(keep=name)
+            logger.info('loaded dataset %s from %s', name, self.paths[name])
+            return dataset
+
+    # unload the least recently used datasets, except the default one and `keep`, until the rest fit the budget
+    def evict(self, keep):
+        if not self.budget_bytes:
+            return
+        sizes = {name: snapshot_memory(dataset.source.current) for name, dataset in self.loaded.items()}
+        for name in list(self.loaded):
+            if sum(sizes.values()) <= self.budget_bytes:
+                break
+            if name in (keep, DEFAULT_DATASET):
+                continue
+            # requests still running on it keep their reference; the next request loads it again
+            self.loaded.pop(name).source.stop()
+            del sizes[name]
+            self.evicted += 1
+            logger.info('unloaded dataset %s to stay within %.0f MB', name, self.budget_bytes / 2 ** 20)
+
+    # data version of every loaded dataset
+    def versions(self):
+        with self.lock:
+            return {name: dataset.source.current.version for name, dataset in self.loaded.items()}
+
+
+datasets = DatasetRegistry(DATASETS, DATASET_MEMORY_MB * 2 ** 20)
+datasets.add(Dataset(DEFAULT_DATASET, DATASETS[DEFAULT_DATASET], df, today, delta_directory(DEFAULT_DATASET)))
+
+
+# the dataset of the running callback
+class _CurrentDataset(threading.local):
+    dataset = None
+
+
+_current_dataset = _CurrentDataset()
+
+
+# the dataset the running callback is answering for, or else the default one
+def current_dataset():
+    return _current_dataset.dataset or datasets.get(DEFAULT_DATASET)
+
+
+# answer the enclosed block from the dataset called `name` (the default one for None), loading it if needed
+@contextmanager
+def using_dataset(name):
+    dataset = datasets.get(name or DEFAULT_DATASET)
+    if dataset is None:
+        raise PreventUpdate
+    previous = _current_dataset.dataset
+    _current_dataset.dataset = dataset
+    try:
+        yield dataset
+    finally:
+        _current_dataset.dataset = previous
+
+# %% [markdown]
+# ### Request Scheduling
+#
+# Dragging a slider fires a burst of requests, and a worker used to answer every one of them in turn, stale slider
+# positions first. Three things keep that queue short. Lookups of a filter state that is already being computed wait
+# for that computation instead of repeating it (see `LRUMemo`). Every page load gets a session id, and a request that
+# is still waiting when a newer one for the same output arrives from the same page gives way with `PreventUpdate`, which
+# Dash treats as "no update". With `HR_FIGURE_WORKERS` set, figures are built in a pool of that many processes forked
+# from the worker, so the worker's threads (`gunicorn --threads`) are not queued behind one another's pandas work; the
+# pool is forked again whenever the data changes.
+
+# %%
+FIGURE_WORKERS = int(os.environ.get('HR_FIGURE_WORKERS', 0))
+
+# sessions whose latest requests are remembered
+REQUEST_SESSIONS = 10000
+
+# seconds between checks on a figure waiting in the pool
+FIGURE_POLL_SECONDS = 0.05
+
+
+class RequestTracker:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.latest = OrderedDict()
+        self.lock = threading.Lock()
+        self.counter = 0
+        self.dropped = 0
+
+    # a ticket for a new request from `session` for `output`, which makes any older one stale
+    def start(self, session, output):
+        with self.lock:
+            self.counter += 1
+            key = (session, output)
+            self.latest[key] = self.counter
+            self.latest.move_to_end(key)
+            while len(self.latest) > self.maxsize:
+                self.latest.popitem(last=False)
+            return key, self.counter
+
+    def superseded(self, ticket):
+        key, number = ticket
+        with self.lock:
+            return self.latest.get(key, number) > number
+
+
+request_tracker = RequestTracker(REQUEST_SESSIONS)
+
+
+# the ticket of the request the running thread is answering
+class _CurrentRequest(threading.local):
+    ticket = None
+
+
+_current_request = _CurrentRequest()
+
+
+# run the enclosed callback body as the latest request from page `session` for `output` (no session, never dropped)
+@contextmanager
+def latest_request(session, output):
+    if not session:
+        yield
+        return
+    _current_request.ticket = request_tracker.start(session, output)
+    try:
+        yield
+    finally:
+        _current_request.ticket = None
+
+
+# whether a newer request from the same page has arrived for the output being computed
+def request_superseded():
+    ticket = _current_request.ticket
+    return ticket is not None and request_tracker.superseded(ticket)
+
+
+# stop answering a request that a newer one has made pointless
+def give_way_if_superseded():
+    if request_superseded():
+        with request_tracker.lock:
+            request_tracker.dropped += 1
+        raise PreventUpdate
+
+
+_figure_pool = None
+_figure_pool_versions = {}
+_figure_pool_lock = threading.Lock()
+
+
+# the process pool for building figures from snapshot `data` of `dataset`, or None when figures are built in the worker
+def figure_pool(dataset, data):
+    global _figure_pool, _figure_pool_versions
+    if FIGURE_WORKERS <= 0:
+        return None
+    with _figure_pool_lock:
+        if _figure_pool is None or _figure_pool_versions.get(dataset.name) != data.version:
+            # processes forked from this one start with its loaded datasets and caches already in memory
+            if _figure_pool is not None:
+                _figure_pool.shutdown(wait=False)
+            context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+            _figure_pool = ProcessPoolExecutor(FIGURE_WORKERS, mp_context=context)
+            _figure_pool_versions = datasets.versions()
+        return _figure_pool
+
+
+# locks held by another thread at fork time would never be released in the pool process, and the forking thread's
+# pinned snapshot, dataset and request would otherwise stay with the process for every later build
+def _reset_locks_after_fork():
+    _pinned.data = None
+    _current_dataset.dataset = None
+    _current_request.ticket = None
+    for holder in (request_tracker, callback_metrics, datasets):
+        holder.lock = threading.Lock()
+    datasets.load_lock = threading.Lock()
+    for dataset in datasets.loaded.values():
+        dataset.source.lock = threading.Lock()
+        for memo in dataset.caches().values():
+            memo.lock = threading.Lock()
+            memo.pending = {}
+
+
+if FIGURE_WORKERS > 0 and hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
+
+
+# `build(spec)` on dataset `name` in a pool process; None when the process holds another version of its data
+def build_in_pool_process(build, spec, name, version):
+    if name not in datasets.loaded:
+        return None
+    with using_dataset(name), pinned_snapshot() as data:
+        if data.version != version:
+            return None
+        return build(spec)
+
+
+# `build(spec)` for snapshot `data`, in the figure pool when there is one
+def run_build(build, spec, data):
+    give_way_if_superseded()
+    dataset = current_dataset()
+    pool = figure_pool(dataset, data)
+    if pool is None:
+        return build(spec)
+
+    try:
+        future = pool.submit(build_in_pool_process, build, spec, dataset.name, data.version)
+        while True:
+            try:
+                result = future.result(timeout=FIGURE_POLL_SECONDS)
+                break
+            except FuturesTimeoutError:
+                # still queued behind other figures: a newer request from the same page takes its place
+                if request_superseded() and future.cancel():
+                    give_way_if_superseded()
+    except (BrokenProcessPool, CancelledError, RuntimeError):
+        # the pool went away (a process died, or a data refresh replaced it): build here instead
+        result = None
+    return build(spec) if result is None else result
+
+# %% [markdown]
+# ### Large-Data Scatter Mode
+#
+# SVG markers with outlines and a name in every hover label stop being usable beyond a few thousand employees. Above
+# `HR_SCATTERGL_THRESHOLD` matching rows the scatter plot switches to WebGL traces without outlines or names, and above
+# `HR_SCATTER_SAMPLE_SIZE` it is reduced on the server, either to a sample stratified by department (`sample`) or to a
+# salary x engagement density grid (`density`), chosen with `HR_SCATTER_LARGE_MODE`. Employee names are looked up only
+# when a point is clicked.
 
 # %%
-#read in the dataset and then see first five rows of the dataframe df
-df = pd.read_csv('data/data.csv')
-df.head()
+# matching rows above which the scatter plot renders with WebGL
+SCATTERGL_THRESHOLD = int(os.environ.get('HR_SCATTERGL_THRESHOLD', 5000))
+
+# points sent to the browser at most, and how larger results are reduced: 'sample', 'density' or 'all'
+SCATTER_SAMPLE_SIZE = int(os.environ.get('HR_SCATTER_SAMPLE_SIZE', 20000))
+SCATTER_LARGE_MODE = os.environ.get('HR_SCATTER_LARGE_MODE', 'sample')
+
+# bins per axis of the density grid
+SCATTER_DENSITY_BINS = int(os.environ.get('HR_SCATTER_DENSITY_BINS', 60))
+
+# departments keep at least this many points in a sample, so small ones stay visible
+SCATTER_SAMPLE_FLOOR = 50
+
+
+# positions into `groups` sampled to about `size` in total, each group in proportion to its share
+def stratified_sample(groups, size, floor=SCATTER_SAMPLE_FLOOR):
+    total = sum(len(rows) for rows in groups.values())
+    rng = np.random.default_rng(0)  # the same filter state always draws the same sample
+    sampled = {}
+    for group, rows in groups.items():
+        share = max(floor, int(round(size * len(rows) / total)))
+        sampled[group] = rows if len(rows) <= share else np.sort(rng.choice(rows, share, replace=False))
+    return sampled
+
+
+# a heatmap trace counting points on a bins x bins grid
+def density_trace(x, y, bins=SCATTER_DENSITY_BINS):
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+    z = counts.T.astype(object)
+    z[z == 0] = None  # empty cells stay transparent
+    return dict(
+        type='heatmap', x=(x_edges[:-1] + x_edges[1:]) / 2, y=(y_edges[:-1] + y_edges[1:]) / 2, z=z,
+        colorscale=[[0, '#e6e6fa'], [1, '#4b2e83']], colorbar=dict(title=dict(text='Employees')),
+        hovertemplate='Salary=%{x:,.0f}<br>EngagementSurvey=%{y:.2f}<br>Employees=%{z}<extra></extra>',
+    )
 
 # %% [markdown]
-# ### Coding UI and Graph Components
+# ### Figure Templates
+#
+# Titles, colors, axes and styling never change with the filters, so each chart's static figure is built once here and
+# embedded in the layout. The callbacks then answer with a `dash.Patch` that only swaps in the traces and, for the bar
+# chart, the annotations. Per-trace styling lives in each template's trace defaults, so the traces sent on every filter
+# change carry little more than their data arrays.
+
+# %%
+# the default plotly template with trace defaults for one chart added
+def chart_template(**trace_defaults):
+    template = go.layout.Template(pio.templates[pio.templates.default])
+    for trace_type, defaults in trace_defaults.items():
+        template.data[trace_type] = [defaults]
+    return template
+
+
+# scatter plot: one marker trace per department, colored in order of appearance
+SCATTER_FIGURE = go.Figure(layout=dict(
+    template=chart_template(
+        scatter=dict(
+            mode='markers',
+            marker=dict(size=10, symbol='circle', line=dict(width=2, color='DarkSlateGrey')),
+            hovertemplate='Department=%{fullData.name}<br>Salary=%{x}<br>EngagementSurvey=%{y}<br>Employee_Name=%{customdata}<extra></extra>',
+        ),
+        # large results: smaller markers without outlines, and names only on click
+        scattergl=dict(
+            mode='markers',
+            marker=dict(size=6),
+            hovertemplate='Department=%{fullData.name}<br>Salary=%{x}<br>EngagementSurvey=%{y}<br>click for name<extra></extra>',
+        ),
+    ),
+    title=dict(text='Employee Engagement Score VS Salary'),
+    colorway=['#6a3d9a', '#9370db', '#9983b8', '#8a2be2', '#d8bfd8', '#e6e6fa'],
+    xaxis=dict(title=dict(text='Salary')),
+    yaxis=dict(title=dict(text='Engagement Survey Score')),  # update the y-axis title
+    legend=dict(title=dict(text='Department'), tracegroupgap=0),
+    plot_bgcolor='rgba(0,0,0,0)',  # transparent background for plot
+    paper_bgcolor='#CCCCCC',  # consistent light gray background
+    font=dict(color='#4b2e83'),  # purple font color
+    margin=dict(t=60),
+))
+
+# gender pie chart: a single pie trace
+PIE_COLORS = ['#A9A9A9', '#5e3a93', '#532e91', '#421987', '#682d79', '#f3f2f4']  # purple shades and one gray
+PIE_FIGURE = go.Figure(layout=dict(
+    template=chart_template(pie=dict(hovertemplate='Sex=%{label}<extra></extra>')),
+    title=dict(text='Gender Distribution', font=dict(size=20, family='Arial', color='#4b2e83')),
+    legend=dict(tracegroupgap=0),
+    paper_bgcolor='#CCCCCC',  # light gray background
+    font=dict(color='#4b2e83'),  # purple text
+    margin=dict(t=60),
+))
+
+# stacked bar chart: one bar trace per recruitment source, plus one satisfaction label per department
+BAR_FIGURE = go.Figure(layout=dict(
+    template=chart_template(),
+    barmode='stack',
+    title=dict(text='Recruitment by Department, with Avg. Dept. Satisfaction at the Top'),
+    colorway=['#6a3d9a', '#7b68ee', '#8a2be2', '#9932cc', '#ba55d3'],  # Richer purple shades
+    yaxis=dict(title=dict(text='Number of People Recruited')),
+    xaxis=dict(title=dict(text='Department')),
+    plot_bgcolor='rgba(0,0,0,0)',
+    paper_bgcolor='#CCCCCC',  # consistent light gray background
+    font=dict(color='#4b2e83'),
+    legend=dict(title=dict(text='Recruitment Source')),
+    showlegend=True,
+))
+BAR_FIGURE.layout.template.layout.annotationdefaults = dict(
+    showarrow=False,
+    font=dict(color='white', size=14),
+    bgcolor='#4b2e83',
+    bordercolor='white',
+    borderwidth=2
+)
+
+# absences line chart: a single line trace
+LINE_FIGURE = go.Figure(layout=dict(
+    template=chart_template(scatter=dict(
+        mode='lines',
+        hovertemplate='Salary Rounded to Nearest $10k=%{x}<br>Average Number of Absences=%{y}<extra></extra>',
+    )),
+    title=dict(text='Absences vs. Rounded Salary'),
+    colorway=['#6a3d9a', '#7b68ee', '#9a32cd', '#9370db', '#A9A9A9'],  # purple shades and one gray
+    xaxis=dict(title=dict(text='Salary Rounded to Nearest $10k')),
+    yaxis=dict(title=dict(text='Average Number of Absences')),
+    legend=dict(tracegroupgap=0),
+    plot_bgcolor='rgba(0,0,0,0)',
+    paper_bgcolor='#CCCCCC',
+    font=dict(color='#4b2e83'),
+    margin=dict(t=60),
+))
+
+
+# headcount chart: active employees at each month's end, with the month's hires and terminations as bars beneath
+HEADCOUNT_FIGURE = go.Figure(layout=dict(
+    template=chart_template(scatter=dict(
+        mode='lines',
+        name='Active Employees',
+        hovertemplate='%{x|%b %Y}<br>Active Employees=%{y}<extra></extra>',
+    )),
+    barmode='group',
+    title=dict(text='Headcount, Hires and Terminations by Month'),
+    colorway=['#4b2e83', '#9370db', '#A9A9A9'],  # purple line, lighter purple and gray bars
+    xaxis=dict(title=dict(text='Month')),
+    yaxis=dict(title=dict(text='Active Employees'), rangemode='tozero'),
+    yaxis2=dict(title=dict(text='Hires and Terminations'), overlaying='y', side='right', rangemode='tozero', showgrid=False),
+    legend=dict(orientation='h', y=-0.2),
+    plot_bgcolor='rgba(0,0,0,0)',
+    paper_bgcolor='#CCCCCC',
+    font=dict(color='#4b2e83'),
+    margin=dict(t=60),
+))
+# bar defaults apply in turn: hires first, then terminations with the month's attrition rate
+HEADCOUNT_FIGURE.layout.template.data.bar = [
+    dict(name='Hires', yaxis='y2', hovertemplate='%{x|%b %Y}<br>Hires=%{y}<extra></extra>'),
+    dict(name='Terminations', yaxis='y2',
+         hovertemplate='%{x|%b %Y}<br>Terminations=%{y}<br>Attrition=%{customdata:.1f}% of the month\'s starting headcount<extra></extra>'),
+]
+
+
+# the static figure of each chart
+FIGURE_TEMPLATES = {'salary-engagement-scatter': SCATTER_FIGURE, 'gender-pie-chart': PIE_FIGURE, 'avg-satisfaction-bar': BAR_FIGURE,
+                    'absences-salary-line': LINE_FIGURE, 'headcount-trend': HEADCOUNT_FIGURE}
+
+
+# a Patch that swaps the traces and changed layout parts of `update` into a chart's static figure
+def figure_patch(update):
+    patched = Patch()
+    patched['data'] = update['data']
+    for key, value in update.get('layout', {}).items():
+        patched['layout'][key] = value
+    return patched
 
 # %% [markdown]
-# (1) UI Components:
-# Dropdown menus for each of the following components:
-# - `Department`
-# - `Position`
-# - `Performance Scores`
-# - `Gender`
-# - `Employment Status`
-# 
-# Sliders that allows the user to select:
-# - `Salary Range`
-# - `Age Range`
-# - `Employee Satisfaction`
-# 
-# Date Range Selector that allows a start and end date for all visuals in the dashboard
-# - `Start Date`
-# - `End Date`
-#  
-# 
-# (2) Write Callback functions for the widgets to interact with the graphs
-# 
-# Layout:
-# - Use a stylesheet
-# - There should be a title at the top of the page
-# - There should be a description of the data and app below the title (3-5 sentences)
-# 
+# ### Clientside Widgets
+#
+# The average salary and the gender pie are a mean and a count over the filtered rows. With `HR_CLIENTSIDE_WIDGETS=1`
+# the page receives a compact columnar snapshot of `Salary`, `Sex` and `DateofHire` once, and each filter change only
+# sends the matching rows, as a packed bitset or a row id list, whichever is smaller. Both widgets are then computed by
+# clientside callbacks in `assets/widgets.js`, with no further server work.
 
 # %%
-# convert DOB to datetime format if not already
-df['DOB'] = pd.to_datetime(df['DOB'])
+# compute the average salary and gender pie in the browser
+CLIENTSIDE_WIDGETS = os.environ.get('HR_CLIENTSIDE_WIDGETS') == '1'
+
+
+# base64 of an array's little-endian bytes, decoded in the browser into a typed array
+def encode_array(values, dtype):
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode('ascii')
+
+
+# the columns the clientside widgets read, encoded once per snapshot
+@per_snapshot
+def widget_columns(data):
+    frame = data.df
+    hired = frame['DateofHire'].to_numpy('datetime64[D]')
+    hired_days = np.where(np.isnat(hired), np.iinfo(np.int32).min, hired.astype('int64'))
+    return {
+        'version': data.version,
+        'salary': encode_array(frame['Salary'].to_numpy(), '<i4'),
+        'sex': encode_array(frame['Sex'].cat.codes.to_numpy(), '<i1'),
+        'sex_labels': list(frame['Sex'].cat.categories),
+        'hired': encode_array(hired_days, '<i4'),
+        'pie_colors': PIE_COLORS,
+    }
+
+
+# the encoded rows matching `spec`, for the clientside widgets
+def widget_rows(spec):
+    return encode_rows(filter_rows(spec), snapshot())
 
-# calculate age correctly
-today = pd.to_datetime('today')
-df['Age'] = today.year - df['DOB'].dt.year
-# adjusting for whether the birthday has happened this year
-df['Age'] -= ((today.month < df['DOB'].dt.month) | ((today.month == df['DOB'].dt.month) & (today.day < df['DOB'].dt.day))).astype(int)
+
+# the rows of snapshot `data` matching a filter state, as row ids or a packed bitset, whichever is smaller
+def encode_rows(rows, data):
+    n_rows = len(data.df)
+    if rows.size * 4 < (n_rows + 7) // 8:
+        return {'version': data.version, 'kind': 'rows', 'data': encode_array(rows, '<i4')}
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[rows] = True
+    return {'version': data.version, 'kind': 'bits', 'data': encode_array(np.packbits(mask), 'u1')}
+
+# %% [markdown]
+# ### Searchable Dropdown Options
+#
+# Positions, and at scale managers, run into the thousands, and every value used to be embedded in the page. The
+# position dropdown now starts with at most `HR_OPTION_LIMIT` options and asks the server as the user types. Each
+# snapshot gets a sorted index of the lowercased labels, one entry per word start, so a search is a binary search for
+# its prefix. A table of which positions occur in which departments narrows the options to the selected departments.
 
 # %%
-# set the minimum salary for the slider
-salary_min = df['Salary'].min()
-# set the maximum salary for the slider
-salary_max = df['Salary'].max()
-# finding a representative middle value for user friendliness in the slider
-salary_mid = round((salary_min + salary_max) / 2 / 1000) * 1000  
-
-# labelling on the slider
-salary_marks = {
-    int(salary_min): f'${int(salary_min):,}',
-    int(salary_mid): f'${int(salary_mid):,}',
-    int(salary_max): f'${int(salary_max):,}'
-}
+# options sent for one search
+OPTION_LIMIT = int(os.environ.get('HR_OPTION_LIMIT', 100))
 
-# set the minimum age for the slider
-age_min = df['Age'].min()
-# set the maximum salary for the slider
-age_max = df['Age'].max()
-# finding a representative middle value for user friendliness in the slider
-age_mid = round((age_min + age_max) / 2 / 10) * 10
-
-# labelling on the slider
-age_marks = {
-    int(age_min): f'{int(age_min)} yrs',
-    int(age_mid): f'{int(age_mid)} yrs',
-    int(age_max): f'{int(age_max)} yrs'
-}
+# filters narrowing each searchable dropdown's options to the values that occur with their selection
+OPTION_NARROWING = {'Position': ['Department']}
+
+
+class OptionIndex:
+    def __init__(self, frame, column, narrowing):
+        values = frame[column]
+        if not isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype('category')
+        self.values = np.asarray(values.cat.categories, dtype=object)
+        codes = values.cat.codes.to_numpy()
+        # values no row has any more are never offered
+        self.present = np.bincount(codes[codes >= 0], minlength=len(self.values)) > 0
+
+        # (label from one of its word starts, value position), sorted
+        entries = sorted(
+            (' '.join(words[start:]), position)
+            for position, value in enumerate(self.values)
+            for words in [str(value).lower().split()]
+            for start in range(len(words))
+        )
+        self.keys = [key for key, _ in entries]
+        self.positions = np.array([position for _, position in entries], dtype=np.int64)
+
+        # for each narrowing column, which of its values occur with which of these
+        self.cooccurrence = {}
+        for other in narrowing:
+            other_codes, other_values = pd.factorize(frame[other])
+            both = (codes >= 0) & (other_codes >= 0)
+            table = np.zeros((len(other_values), len(self.values)), dtype=bool)
+            table[other_codes[both], codes[both]] = True
+            self.cooccurrence[other] = (pd.Index(other_values), table)
+
+    # values with a word starting with `search`, occurring with the values selected in the narrowing columns
+    def matches(self, search, selected):
+        allowed = self.present.copy()
+        for other, chosen in selected.items():
+            if chosen and other in self.cooccurrence:
+                labels, table = self.cooccurrence[other]
+                found = labels.get_indexer(chosen)
+                allowed &= table[found[found >= 0]].any(axis=0)
+
+        search = ' '.join((search or '').lower().split())
+        if search:
+            start = bisect.bisect_left(self.keys, search)
+            stop = bisect.bisect_left(self.keys, search + '\uffff', start)
+            positions = np.unique(self.positions[start:stop])
+        else:
+            positions = np.arange(len(self.values))
+        return self.values[positions[allowed[positions]][:OPTION_LIMIT]].tolist()
 
-# correcting marks for EmpSatisfaction slider to ensure keys are Python integers
-satisfaction_marks = {int(satisfaction): str(satisfaction) for satisfaction in sorted(df['EmpSatisfaction'].unique())}
+
+# the option index of `column` in snapshot `data`, built on first use
+@per_snapshot
+def option_index(data, column):
+    return OptionIndex(data.df, column, OPTION_NARROWING.get(column, []))
+
+
+# dropdown options matching `search` under the `narrowing` selections, after the values already `selected`
+def dropdown_options(data, column, search=None, selected=None, narrowing=None):
+    values = option_index(data, column).matches(search, narrowing or {})
+    selected = [value for value in selected or [] if value not in values]
+    return [{'label': value, 'value': value} for value in selected + values]
 
 # %%
 # import external stylesheet using class code below
 
 stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css'] # load the CSS stylesheet
 
-app = dash.Dash(__name__, external_stylesheets=stylesheets) # initialize the app
+# the page's components only exist once the page for the URL's dataset is rendered
+app = dash.Dash(__name__, external_stylesheets=stylesheets, suppress_callback_exceptions=True) # initialize the app
 server = app.server
 
+
+# every process serving requests watches the files of its loaded datasets itself, starting with its first request: a
+# watcher started at import would only run in the gunicorn master under --preload, and never in the workers
+@server.before_request
+def watch_datasets():
+    for dataset in list(datasets.loaded.values()):
+        dataset.watch()
+
 # %%
-app.layout = html.Div(children=[
-    html.H1('HR Analytics Dashboard', style={'textAlign': 'center', 'color': 'white', 'backgroundColor': '#4b2e83', 'padding': '20px'}),  # white text color for the title, purple background
+# the page for snapshot `data`, built once per data version so that new departments, positions and ranges show up
+@per_snapshot
+def page_layout(data):
+    frame = data.df
+    salary_marks, age_marks, satisfaction_marks = slider_marks(frame)
+
+    return html.Div(children=[
+        html.H1('HR Analytics Dashboard', style={'textAlign': 'center', 'color': 'white', 'backgroundColor': '#4b2e83', 'padding': '20px'}),  # white text color for the title, purple background
 
-    html.P('''
-        Welcome to our HR Analytics Dashboard! This powerful tool brings you closer to understanding the intricacies of employee engagement, performance, and satisfaction across the spectrum of departments, job positions, and diverse demographic backgrounds.
-        Leverage the intuitive filters to segment the data meaningfully, and embark on your journey towards data-driven HR excellence today. Discover trends, pinpoint opportunities for improvement, and make informed decisions that lead to impactful outcomes. This data is from 10 years ago, but was updated 3 years ago to include more variables.
-        ''', style={'textAlign': 'center', 'color': 'white', 'backgroundColor': '#4b2e83', 'padding': '20px'}),  # white text color for the description of the app, purple background
+        html.P('''
+            Welcome to our HR Analytics Dashboard! This powerful tool brings you closer to understanding the intricacies of employee engagement, performance, and satisfaction across the spectrum of departments, job positions, and diverse demographic backgrounds.
+            Leverage the intuitive filters to segment the data meaningfully, and embark on your journey towards data-driven HR excellence today. Discover trends, pinpoint opportunities for improvement, and make informed decisions that lead to impactful outcomes. This data is from 10 years ago, but was updated 3 years ago to include more variables.
+            ''', style={'textAlign': 'center', 'color': 'white', 'backgroundColor': '#4b2e83', 'padding': '20px'}),  # white text color for the description of the app, purple background
 
-    html.Div([
-        # sidebar with filters
         html.Div([
-            # each dropdown filter component here
-            dcc.Dropdown(id='department-dropdown', options=[{'label': dept, 'value': dept} for dept in df['Department'].unique()], value=None, placeholder='Select Department', multi=True),  # to select multiple inputs
-            dcc.Dropdown(id='position-dropdown', options=[{'label': pos, 'value': pos} for pos in df['Position'].unique()], value=None, placeholder='Select Position', multi=True),
-            dcc.Dropdown(id='performance-dropdown', options=[{'label': score, 'value': score} for score in df['PerformanceScore'].unique()], value=None, placeholder='Select Performance Score', multi=True),
-            dcc.Dropdown(id='gender-dropdown', options=[{'label': gender, 'value': gender} for gender in df['Sex'].unique()], value=None, placeholder='Select Gender'),
-            dcc.Dropdown(id='employment-status-dropdown', options=[{'label': status, 'value': status} for status in df['EmploymentStatus'].unique()], value=None, placeholder='Select Employment Status', multi=True),
-            
-            # salary slider with label
+            # sidebar with filters
             html.Div([
-                html.Label('Salary', style={'fontSize': 15, 'marginTop': '20px'}),
-                dcc.RangeSlider(id='salary-slider', min=df['Salary'].min(), max=df['Salary'].max(), value=[df['Salary'].min(), df['Salary'].max()], marks=salary_marks),
-            ], style={'marginBottom': '20px'}),
+                # each dropdown filter component here
+                dcc.Dropdown(id='department-dropdown', options=[{'label': dept, 'value': dept} for dept in frame['Department'].unique()], value=None, placeholder='Select Department', multi=True),  # to select multiple inputs
+                dcc.Dropdown(id='position-dropdown', options=dropdown_options(data, 'Position'), value=None, placeholder='Select Position', multi=True),
+                dcc.Dropdown(id='performance-dropdown', options=[{'label': score, 'value': score} for score in frame['PerformanceScore'].unique()], value=None, placeholder='Select Performance Score', multi=True),
+                dcc.Dropdown(id='gender-dropdown', options=[{'label': gender, 'value': gender} for gender in frame['Sex'].unique()], value=None, placeholder='Select Gender'),
+                dcc.Dropdown(id='employment-status-dropdown', options=[{'label': status, 'value': status} for status in frame['EmploymentStatus'].unique()], value=None, placeholder='Select Employment Status', multi=True),
+            
+                # salary slider with label
+                html.Div([
+                    html.Label('Salary', style={'fontSize': 15, 'marginTop': '20px'}),
+                    dcc.RangeSlider(id='salary-slider', min=frame['Salary'].min(), max=frame['Salary'].max(), value=[frame['Salary'].min(), frame['Salary'].max()], marks=salary_marks),
+                ], style={'marginBottom': '20px'}),
 
-            # age slider with label
-            html.Div([
-                html.Label('Age', style={'fontSize': 15, 'marginTop': '20px'}),
-                dcc.RangeSlider(id='age-slider', min=df['Age'].min(), max=df['Age'].max(), value=[df['Age'].min(), df['Age'].max()], marks=age_marks),
-            ], style={'marginBottom': '20px'}),
+                # age slider with label
+                html.Div([
+                    html.Label('Age', style={'fontSize': 15, 'marginTop': '20px'}),
+                    dcc.RangeSlider(id='age-slider', min=frame['Age'].min(), max=frame['Age'].max(), value=[frame['Age'].min(), frame['Age'].max()], marks=age_marks),
+                ], style={'marginBottom': '20px'}),
 
-            # checklist with label
-            html.Div([
-                html.Label('Employee Satisfaction Score', style={'fontSize': 15, 'marginTop': '20px'}),
-                dcc.Checklist(id='satisfaction-checklist', options=[{'label': str(satisfaction), 'value': satisfaction} for satisfaction in sorted(df['EmpSatisfaction'].unique())], value=df['EmpSatisfaction'].unique()),  # sets all options as default selections
-            ], style={'marginBottom': '20px'}),
+                # checklist with label
+                html.Div([
+                    html.Label('Employee Satisfaction Score', style={'fontSize': 15, 'marginTop': '20px'}),
+                    dcc.Checklist(id='satisfaction-checklist', options=[{'label': str(satisfaction), 'value': satisfaction} for satisfaction in sorted(frame['EmpSatisfaction'].unique())], value=frame['EmpSatisfaction'].unique()),  # sets all options as default selections
+                ], style={'marginBottom': '20px'}),
 
-            # date range selector with label
-            html.Div([
-                html.Label('Date Range', style={'fontSize': '16px', 'marginTop': '20px'}),
-                html.Div('earliest is 2006-01-09 and latest is 2018-07-09', style={'fontStyle': 'italic', 'fontSize': '12px'}),
-                dcc.DatePickerRange(id='date-picker-range', start_date=df['DateofHire'].min(), end_date=df['DateofHire'].max(), display_format='YYYY-MM-DD'),
+                # date range selector with label
+                html.Div([
+                    html.Label('Date Range', style={'fontSize': '16px', 'marginTop': '20px'}),
+                    html.Div('earliest is 2006-01-09 and latest is 2018-07-09', style={'fontStyle': 'italic', 'fontSize': '12px'}),
+                    dcc.DatePickerRange(id='date-picker-range', start_date=frame['DateofHire'].min().strftime('%Y-%m-%d'), end_date=frame['DateofHire'].max().strftime('%Y-%m-%d'), display_format='YYYY-MM-DD'),
+                ], style={'width': '25%', 'display': 'inline-block', 'verticalAlign': 'top', 'padding': '10px', 'backgroundColor': '#A390C1'}),
             ], style={'width': '25%', 'display': 'inline-block', 'verticalAlign': 'top', 'padding': '10px', 'backgroundColor': '#A390C1'}),
-        ], style={'width': '25%', 'display': 'inline-block', 'verticalAlign': 'top', 'padding': '10px', 'backgroundColor': '#A390C1'}),
             
 
-            # main content area with graphs and average salary display
-            html.Div([
-                # row for scatter plot and other components
+                # main content area with graphs and average salary display
                 html.Div([
-                    dcc.Graph(id='salary-engagement-scatter', style={'display': 'inline-block', 'width': '80%', 'minHeight': '400px'}),
+                    # row for scatter plot and other components
                     html.Div([
-                        html.H4("Average Base Salary", style={'textAlign': 'center', 'color': '#4b2e83', 'fontSize': '20px'}),
-                        html.Div(id='average-salary-display', style={'textAlign': 'center', 'color': '#4b2e83', 'fontSize': '60px', 'padding': '10px', 'border': '2px solid #4b2e83', 'borderRadius': '5px', 'background': '#d3d3d3'}),
-                    ], style={'display': 'inline-block', 'width': '25%', 'minHeight': '300px', 'verticalAlign': 'top', 'marginTop': '20px'}),
-                    dcc.Graph(id='gender-pie-chart', style={'display': 'inline-block', 'width': '30%', 'minHeight': '400px'}),
-                ], style={'display': 'flex', 'width': '100%'}),
+                        # columns and matching rows for the clientside widgets
+                        dcc.Store(id='widget-columns', data=widget_columns(data) if CLIENTSIDE_WIDGETS else None),
+                        # the version of those columns, so the page can be sent new ones after a data refresh
+                        dcc.Store(id='widget-version', data=data.version if CLIENTSIDE_WIDGETS else None),
+                        dcc.Store(id='widget-rows'),
+                        dcc.Graph(id='salary-engagement-scatter', figure=SCATTER_FIGURE, style={'display': 'inline-block', 'width': '80%', 'minHeight': '400px'}),
+                        html.Div([
+                            html.H4("Average Base Salary", style={'textAlign': 'center', 'color': '#4b2e83', 'fontSize': '20px'}),
+                            html.Div(id='average-salary-display', style={'textAlign': 'center', 'color': '#4b2e83', 'fontSize': '60px', 'padding': '10px', 'border': '2px solid #4b2e83', 'borderRadius': '5px', 'background': '#d3d3d3'}),
+                            html.P(id='scatter-click-detail', style={'textAlign': 'center', 'color': '#4b2e83', 'fontSize': '13px', 'fontStyle': 'italic'}),  # name of the clicked scatter point
+                        ], style={'display': 'inline-block', 'width': '25%', 'minHeight': '300px', 'verticalAlign': 'top', 'marginTop': '20px'}),
+                        dcc.Graph(id='gender-pie-chart', figure=PIE_FIGURE, style={'display': 'inline-block', 'width': '30%', 'minHeight': '400px'}),
+                    ], style={'display': 'flex', 'width': '100%'}),
 
-                # row for bar graph and line graph
-                html.Div([
-                    dcc.Graph(id='avg-satisfaction-bar', style={'display': 'inline-block', 'width': '65%', 'minHeight': '600px'}),
-                    dcc.Graph(id='absences-salary-line', style={'display': 'inline-block', 'width': '35%', 'minHeight': '540px'}),
-                ], style={'display': 'flex', 'width': '100%'}),
+                    # row for bar graph and line graph
+                    html.Div([
+                        dcc.Graph(id='avg-satisfaction-bar', figure=BAR_FIGURE, style={'display': 'inline-block', 'width': '65%', 'minHeight': '600px'}),
+                        dcc.Graph(id='absences-salary-line', figure=LINE_FIGURE, style={'display': 'inline-block', 'width': '35%', 'minHeight': '540px'}),
+                    ], style={'display': 'flex', 'width': '100%'}),
+
+                    # row for the headcount trend over the picked date range
+                    html.Div([
+                        dcc.Graph(id='headcount-trend', figure=HEADCOUNT_FIGURE, style={'width': '100%', 'minHeight': '450px'}),
+                    ], style={'display': 'flex', 'width': '100%'}),
 
-                html.Div([
                     html.Div([
-                        html.H2("Specific Employee Information", style={'textAlign': 'left', 'color': '#4b2e83', 'fontSize': '20px'}), # header for the data table
-                        html.P("updated based on filters on the left", style={'textAlign': 'left', 'color': '#4b2e83', 'fontSize': '13px', 'fontStyle': 'italic'}) # disclaimer right under the heading
-                    ], style={'backgroundColor': '#CCCCCC', 'padding': '10px'}),
-                # now adding the DataTable
-                    dash_table.DataTable(
-                        id='employee-data-table',
-                        columns=[
-                            {"name": "Employee Name", "id": "Employee_Name"},
-                            {"name": "Salary", "id": "Salary"},
-                            {"name": "Department", "id": "Department"},
-                            {"name": "Manager Name", "id": "ManagerName"},
-                            {"name": "Recruitment Source", "id": "RecruitmentSource"},
-                            {"name": "Last Performance Review Date", "id": "LastPerformanceReview_Date"},
-                            {"name": "Marital Status", "id": "MaritalDesc"},
-                            {"name": "Race", "id": "RaceDesc"},
-                            {"name": "Date of Birth", "id": "DOB"},
-                            {"name": "Absences", "id": "Absences"}
-                        ],
-                        data=[],  # initial empty data, will be populated by callback
-                        style_table={'width': '100%', 'minWidth': '100%', 'height': '300px', 'overflowX': 'auto'},
-                        style_cell={'minWidth': '100px', 'width': '150px', 'maxWidth': '200px', 'whiteSpace': 'normal'},
-                        style_header={
-                            'backgroundColor': '#4b2e83',
-                            'color': 'white',
-                            'fontWeight': 'bold'
-                        },
-                        style_data={
-                            'backgroundColor': 'white',
-                            'color': 'black',
-                            'border': '1px solid grey'
-                        },
-                        filter_action='native',  # allows for column-based filtering
-                        sort_action='native',    # allows for sorting on columns
-                        sort_mode='multi'        # allows sorting across multiple columns
-                    )
-                ], style={'width': '100%', 'display': 'inline-block', 'verticalAlign': 'top', 'backgroundColor': '#f3f2f4'}),
-
-            ], style={'width': '75%', 'display': 'inline-block', 'verticalAlign': 'top', 'backgroundColor': '#CCCCCC'}),
-        ], style={'display': 'flex', 'width': '100%'}),
-    ])
+                        html.Div([
+                            html.H2("Specific Employee Information", style={'textAlign': 'left', 'color': '#4b2e83', 'fontSize': '20px'}), # header for the data table
+                            html.P("updated based on filters on the left", style={'textAlign': 'left', 'color': '#4b2e83', 'fontSize': '13px', 'fontStyle': 'italic'}), # disclaimer right under the heading
+                            # downloads of the table as filtered and sorted, pointed at the current filters by a callback
+                            html.Div([
+                                html.A("Download CSV", id='export-csv-link', href='', style={'color': '#4b2e83', 'fontSize': '13px', 'marginRight': '15px'}),
+                                html.A("Download Parquet", id='export-parquet-link', href='',
+                                       style={'color': '#4b2e83', 'fontSize': '13px', 'display': 'inline' if pyarrow else 'none'}),
+                            ])
+                        ], style={'backgroundColor': '#CCCCCC', 'padding': '10px'}),
+                    # now adding the DataTable, with the current page as sent by the server
+                        dcc.Store(id='employee-table-page'),
+                        dash_table.DataTable(
+                            id='employee-data-table',
+                            columns=TABLE_COLUMNS,
+                            data=[],  # initial empty data, will be populated by callback
+                            style_table={'width': '100%', 'minWidth': '100%', 'height': '300px', 'overflowX': 'auto'},
+                            style_cell={'minWidth': '100px', 'width': '150px', 'maxWidth': '200px', 'whiteSpace': 'normal'},
+                            style_header={
+                                'backgroundColor': '#4b2e83',
+                                'color': 'white',
+                                'fontWeight': 'bold'
+                            },
+                            style_data={
+                                'backgroundColor': 'white',
+                                'color': 'black',
+                                'border': '1px solid grey'
+                            },
+                            page_action='custom',    # pages are cut on the server
+                            page_current=0,
+                            page_size=TABLE_PAGE_SIZE,
+                            filter_action='custom',  # allows for column-based filtering, applied on the server
+                            filter_query='',
+                            sort_action='custom',    # allows for sorting on columns, applied on the server
+                            sort_mode='multi',       # allows sorting across multiple columns
+                            sort_by=[]
+                        )
+                    ], style={'width': '100%', 'display': 'inline-block', 'verticalAlign': 'top', 'backgroundColor': '#f3f2f4'}),
+
+                ], style={'width': '75%', 'display': 'inline-block', 'verticalAlign': 'top', 'backgroundColor': '#CCCCCC'}),
+            ], style={'display': 'flex', 'width': '100%'}),
+        ])
+
+
+# the shell of every load: the URL, a session id identifying the load so requests it has made obsolete can be dropped,
+# the tab's session state that survives reloads, and the page of the URL's dataset once rendered
+def serve_layout():
+    return html.Div([dcc.Location(id='url'), dcc.Store(id='session-id', data=uuid.uuid4().hex),
+                     dcc.Store(id='session-state', storage_type='session', data={}), html.Div(id='page')])
+
+
+app.layout = serve_layout
+
+
+# callback rendering the page of the dataset named by the URL, / for the default one and /<name> for the others
+@app.callback(
+    Output('page', 'children'),
+    [Input('url', 'pathname')],
+    [State('session-state', 'data')])
+@instrumented
+def render_page(pathname, session_state=None):
+    name = app.strip_relative_path(pathname or '/') or DEFAULT_DATASET
+    if name not in DATASETS:
+        return html.H1(f'No dataset called {name}', style={'textAlign': 'center', 'color': 'white', 'backgroundColor': '#4b2e83', 'padding': '20px'})
+    # every callback on the page reads the dataset's name from here
+    with using_dataset(name), pinned_snapshot() as data:
+        page = page_layout(data)
+        state = session_entry(session_state.get(name)) if isinstance(session_state, dict) else None
+        if state:
+            page = with_props(page, restored_props(data, state))
+        return [dcc.Store(id='dataset', data=name), page]
+
+
+# the table page sent in columns, turned into the rows the DataTable takes
+app.clientside_callback(
+    ClientsideFunction(namespace='hr', function_name='table_records'),
+    Output('employee-data-table', 'data'),
+    [Input('employee-table-page', 'data')])
+
+
+# callback serving position options as the user types, within the selected departments
+@app.callback(
+    Output('position-dropdown', 'options'),
+    [Input('position-dropdown', 'search_value'),
+     Input('department-dropdown', 'value')],
+    [State('position-dropdown', 'value'),
+     State('dataset', 'data')])
+@instrumented
+def update_position_options(search_value, department, position, dataset=None):
+    with using_dataset(dataset):
+        return dropdown_options(snapshot(), 'Position', search_value, position, {'Department': department})
 
 # callback for updating the scatter plot
 @app.callback(
-    [Output('salary-engagement-scatter', 'figure'),
-     Output('average-salary-display', 'children')],
+    Output('salary-engagement-scatter', 'figure'),
     [Input('department-dropdown', 'value'),
      Input('position-dropdown', 'value'),
      Input('performance-dropdown', 'value'),
@@ -262,59 +2599,200 @@ app.layout = html.Div(children=[
      Input('age-slider', 'value'),
      Input('satisfaction-checklist', 'value'),
      Input('date-picker-range', 'start_date'),
-     Input('date-picker-range', 'end_date')])
-def update_scatter_plot(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date):
-    # ensure DateofHire is a datetime object for date filtering
-    filtered_df = df.copy()
-    filtered_df['DateofHire'] = pd.to_datetime(filtered_df['DateofHire'])
-
-    # apply filters based on the inputs
-    if department:
-        filtered_df = filtered_df[filtered_df['Department'].isin(department)]
-    if position:
-        filtered_df = filtered_df[filtered_df['Position'].isin(position)]
-    if performance:
-        filtered_df = filtered_df[filtered_df['PerformanceScore'].isin(performance)]
-    if gender:
-        filtered_df = filtered_df[filtered_df['Sex'] == gender]
-    if employment_status:
-        filtered_df = filtered_df[filtered_df['EmploymentStatus'].isin(employment_status)]
-    if salary_range:
-        filtered_df = filtered_df[(filtered_df['Salary'] >= salary_range[0]) & (filtered_df['Salary'] <= salary_range[1])]
-    if age_range:
-        filtered_df = filtered_df[(filtered_df['Age'] >= age_range[0]) & (filtered_df['Age'] <= age_range[1])]
-    if satisfaction:
-        filtered_df = filtered_df[filtered_df['EmpSatisfaction'].isin(satisfaction)]
-
-    # generate and return scatter plot figure based on filtered_df
-    fig_scatter = px.scatter(
-        filtered_df, x='Salary', y='EngagementSurvey', color='Department',
-        title='Employee Engagement Score VS Salary', 
-        hover_data=['Employee_Name'],
-        color_discrete_sequence=['#6a3d9a', '#9370db', '#9983b8', '#8a2be2', '#d8bfd8', '#e6e6fa']
-    )
-    
-    fig_scatter.update_layout(
-        plot_bgcolor='rgba(0,0,0,0)',  # transparent background for plot
-        paper_bgcolor='#CCCCCC',  # consistent light gray background
-        font=dict(color='#4b2e83'),  # purple font color
-        legend_title_text='Department'
-    )
+     Input('date-picker-range', 'end_date')],
+    [State('session-id', 'data'),
+     State('dataset', 'data')])
+@instrumented
+def update_scatter_plot(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date,
+                        session_id=None, dataset=None):
+    # the scatter plot has never been restricted by the hire date range
+    spec = FilterSpec.from_inputs(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction)
+    with using_dataset(dataset), latest_request(session_id, 'salary-engagement-scatter'):
+        return figure_patch(cached_figure('salary-engagement-scatter', spec, scatter_plot))
+
+
+# scatter plot traces for the employees matching `spec`
+def scatter_plot(spec):
+    rows = filter_rows(spec)
+    large = len(rows) > SCATTERGL_THRESHOLD
+    # large results carry the employee id for click lookups instead of every name
+    label_column = 'EmpID' if large else 'Employee_Name'
+    filtered_df = filtered_employees(spec, ['Department', 'Salary', 'EngagementSurvey', label_column])
+
+    salary = filtered_df['Salary'].to_numpy()
+    engagement = filtered_df['EngagementSurvey'].to_numpy(dtype=float).round(2)
+    labels = filtered_df[label_column].to_numpy()
+
+    if large and SCATTER_LARGE_MODE == 'density' and len(rows) > SCATTER_SAMPLE_SIZE:
+        with phase('aggregate'):
+            return {'data': [density_trace(salary, engagement)]}
+
+    # one trace per department, in order of first appearance like plotly express
+    with phase('aggregate'):
+        rows_by_department = filtered_df.groupby('Department', observed=True).indices
+        rows_by_department = {dept: rows_by_department[dept] for dept in pd.unique(filtered_df['Department'])}
+        if large and SCATTER_LARGE_MODE == 'sample' and len(rows) > SCATTER_SAMPLE_SIZE:
+            rows_by_department = stratified_sample(rows_by_department, SCATTER_SAMPLE_SIZE)
+
+    with phase('figure'):
+        traces = [
+            dict(type='scattergl' if large else 'scatter', name=dept, legendgroup=dept,
+                 x=salary[positions], y=engagement[positions], customdata=labels[positions])
+            for dept, positions in rows_by_department.items()
+        ]
+
+    return {'data': traces}
+
+
+# average salary text for the employees matching `spec`
+def average_salary_text(spec):
+    cells = cube_cells(spec)
+    if cells is not None:
+        with phase('aggregate'):
+            count = cells['Salary_n'].sum()
+            average_salary = cells['Salary_sum'].sum() / count if count else np.nan
+        return f"${average_salary/1000:.1f}k"
+
+    rows = filter_rows(spec)
+    with phase('aggregate'):
+        average_salary = snapshot().df['Salary'].to_numpy()[rows].mean()
+    return f"${average_salary/1000:.1f}k"
+
+
+if CLIENTSIDE_WIDGETS:
+    # matching rows for the clientside widgets, with the scatter plot's filters (the pie applies the dates itself), and
+    # the columns again when the data has been refreshed since the page got them
+    @app.callback(
+        [Output('widget-rows', 'data'),
+         Output('widget-columns', 'data'),
+         Output('widget-version', 'data')],
+        [Input('department-dropdown', 'value'),
+         Input('position-dropdown', 'value'),
+         Input('performance-dropdown', 'value'),
+         Input('gender-dropdown', 'value'),
+         Input('employment-status-dropdown', 'value'),
+         Input('salary-slider', 'value'),
+         Input('age-slider', 'value'),
+         Input('satisfaction-checklist', 'value')],
+        [State('session-id', 'data'),
+         State('dataset', 'data'),
+         State('widget-version', 'data')])
+    @instrumented
+    def update_widget_rows(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, session_id=None, dataset=None,
+                           widget_version=None):
+        spec = FilterSpec.from_inputs(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction)
+        with using_dataset(dataset), latest_request(session_id, 'widget-rows'), pinned_snapshot() as data:
+            rows = cached_figure('widget-rows', spec, widget_rows)
+            if data.version == widget_version:
+                return rows, dash.no_update, dash.no_update
+            return rows, widget_columns(data), data.version
+
+    # the average salary and gender pie, computed in the browser
+    app.clientside_callback(
+        ClientsideFunction(namespace='hr', function_name='average_salary'),
+        Output('average-salary-display', 'children'),
+        [Input('widget-columns', 'data'),
+         Input('widget-rows', 'data')])
+    app.clientside_callback(
+        ClientsideFunction(namespace='hr', function_name='gender_pie'),
+        Output('gender-pie-chart', 'figure'),
+        [Input('widget-columns', 'data'),
+         Input('widget-rows', 'data'),
+         Input('date-picker-range', 'start_date'),
+         Input('date-picker-range', 'end_date')],
+        [State('gender-pie-chart', 'figure')])
+else:
+    # callback for updating the average salary display
+    @app.callback(
+        Output('average-salary-display', 'children'),
+        [Input('department-dropdown', 'value'),
+         Input('position-dropdown', 'value'),
+         Input('performance-dropdown', 'value'),
+         Input('gender-dropdown', 'value'),
+         Input('employment-status-dropdown', 'value'),
+         Input('salary-slider', 'value'),
+         Input('age-slider', 'value'),
+         Input('satisfaction-checklist', 'value')],
+        [State('session-id', 'data'),
+     State('dataset', 'data')])
+    @instrumented
+    def update_average_salary(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, session_id=None, dataset=None):
+        # like the scatter plot, the average salary has never been restricted by the hire date range
+        spec = FilterSpec.from_inputs(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction)
+        with using_dataset(dataset), latest_request(session_id, 'average-salary-display'):
+            return cached_figure('average-salary-display', spec, average_salary_text)
+
+    # callback for updating the gender pie chart
+    @app.callback(
+        Output('gender-pie-chart', 'figure'),
+        [Input('department-dropdown', 'value'),
+         Input('position-dropdown', 'value'),
+         Input('performance-dropdown', 'value'),
+         Input('gender-dropdown', 'value'),
+         Input('employment-status-dropdown', 'value'),
+         Input('salary-slider', 'value'),
+         Input('age-slider', 'value'),
+         Input('satisfaction-checklist', 'value'),
+         Input('date-picker-range', 'start_date'),
+         Input('date-picker-range', 'end_date')],
+        [State('session-id', 'data'),
+     State('dataset', 'data')])
+    @instrumented
+    def update_gender_pie_chart(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date,
+                                session_id=None, dataset=None):
+        spec = FilterSpec.from_inputs(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date)
+        with using_dataset(dataset), latest_request(session_id, 'gender-pie-chart'):
+            return figure_patch(cached_figure('gender-pie-chart', spec, gender_pie_chart))
+
 
-    # update the y-axis title
-    fig_scatter.update_yaxes(title_text='Engagement Survey Score')
+# callback showing the name of a clicked scatter point
+@app.callback(
+    Output('scatter-click-detail', 'children'),
+    [Input('salary-engagement-scatter', 'clickData')],
+    [State('dataset', 'data')])
+@instrumented
+def show_clicked_employee(click_data, dataset=None):
+    point = (click_data or {}).get('points', [{}])[0]
+    label = point.get('customdata')
+    if label is None:
+        return 'Click a point to see the employee'
+
+    # WebGL points carry the employee id, looked up only now
+    if not isinstance(label, str):
+        with using_dataset(dataset):
+            frame = snapshot().df
+        matches = frame.loc[frame['EmpID'] == label, 'Employee_Name']
+        if matches.empty:
+            return 'Click a point to see the employee'
+        label = matches.iloc[0]
+    return f"{label}: ${point['x']:,.0f}, engagement {point['y']}"
 
-    # update traces
-    fig_scatter.update_traces(marker=dict(size=10, line=dict(width=2, color='DarkSlateGrey')))
+# gender pie chart trace for the employees matching `spec`
+def gender_pie_chart(spec):
+    cells = cube_cells(spec)
+    if cells is not None:
+        # one slice per gender, ordered by each gender's first row so each keeps its color
+        with phase('aggregate'):
+            by_sex = cells.groupby('Sex', observed=True).agg(count=('count', 'sum'), first=('first', 'min'))
+            labels = by_sex.sort_values('first').index
+            counts = by_sex['count']
+    else:
+        # filter data based on the selected filters
+        sex = filtered_employees(spec, ['Sex'])['Sex']
 
-    average_salary = filtered_df['Salary'].mean()
-    average_salary_display = f"${average_salary/1000:.1f}k"
+        # one slice per gender, in order of first appearance so each keeps its color
+        with phase('aggregate'):
+            labels = pd.unique(sex.dropna())
+            counts = sex.value_counts()
+    with phase('figure'):
+        pie_chart = dict(type='pie', labels=list(labels), values=[int(counts[label]) for label in labels],
+                         marker=dict(colors=PIE_COLORS))
 
-    return fig_scatter, average_salary_display
+    return {'data': [pie_chart]}
 
-# callback for updating the gender pie chart
+# callback to update the stacked bar chart
 @app.callback(
-    Output('gender-pie-chart', 'figure'),
+    Output('avg-satisfaction-bar', 'figure'),
     [Input('department-dropdown', 'value'),
      Input('position-dropdown', 'value'),
      Input('performance-dropdown', 'value'),
@@ -324,52 +2802,70 @@ def update_scatter_plot(department, position, performance, gender, employment_st
      Input('age-slider', 'value'),
      Input('satisfaction-checklist', 'value'),
      Input('date-picker-range', 'start_date'),
-     Input('date-picker-range', 'end_date')])
-def update_gender_pie_chart(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date):
-    # filter data based on the selected filters
-    df_filtered = df.copy()
-
-    # convert 'DateofHire' to datetime for filtering
-    df_filtered['DateofHire'] = pd.to_datetime(df_filtered['DateofHire'])
-
-    if department:
-        df_filtered = df_filtered[df_filtered['Department'].isin(department)]
-    if position:
-        df_filtered = df_filtered[df_filtered['Position'].isin(position)]
-    if performance:
-        df_filtered = df_filtered[df_filtered['PerformanceScore'].isin(performance)]
-    if gender:
-        df_filtered = df_filtered[df_filtered['Sex'] == gender]
-    if employment_status:
-        df_filtered = df_filtered[df_filtered['EmploymentStatus'].isin(employment_status)]
-    if salary_range:
-        df_filtered = df_filtered[(df_filtered['Salary'] >= salary_range[0]) & (df_filtered['Salary'] <= salary_range[1])]
-    if age_range:
-        df_filtered = df_filtered[(df_filtered['Age'] >= age_range[0]) & (df_filtered['Age'] <= age_range[1])]
-    if satisfaction:
-        df_filtered = df_filtered[df_filtered['EmpSatisfaction'].isin(satisfaction)]
-    if start_date and end_date:
-        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
-        df_filtered = df_filtered[(df_filtered['DateofHire'] >= start_date_obj) & (df_filtered['DateofHire'] <= end_date_obj)]
-
-    # define my purple and gray color scheme
-    colors = ['#A9A9A9', '#5e3a93', '#532e91', '#421987', '#682d79', '#f3f2f4']  # purple shades and one gray
-
-    pie_chart = px.pie(df_filtered, names='Sex', title='Gender Distribution')
-    pie_chart.update_traces(marker=dict(colors=colors))
-    pie_chart.update_layout(
-        paper_bgcolor='#CCCCCC',  # light gray background
-        font=dict(color='#4b2e83'),  # purple text
-        title_font=dict(size=20, family='Arial', color='#4b2e83')
-    )
+     Input('date-picker-range', 'end_date')],
+    [State('session-id', 'data'),
+     State('dataset', 'data')])
+@instrumented
+def update_bar_chart(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date,
+                     session_id=None, dataset=None):
+    spec = FilterSpec.from_inputs(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date)
+    with using_dataset(dataset), latest_request(session_id, 'avg-satisfaction-bar'):
+        return figure_patch(cached_figure('avg-satisfaction-bar', spec, satisfaction_bar_chart))
 
-    return pie_chart
-# callback to update the stacked bar chart
+
+# stacked recruitment bar traces and satisfaction labels for the employees matching `spec`
+def satisfaction_bar_chart(spec):
+    cells = cube_cells(spec)
+    if cells is not None:
+        # department x recruitment source counts plus satisfaction sums, summed from the cube
+        with phase('aggregate'):
+            grouped = cells.groupby(['Department', 'RecruitmentSource'], observed=True)[['count', 'EmpSatisfaction_sum', 'EmpSatisfaction_n']].sum()
+            grouped.columns = ['size', 'sum', 'count']
+    else:
+        # only the three columns this chart reads, for the rows matching the selected filters
+        filtered_df1 = filtered_employees(spec, ['Department', 'RecruitmentSource', 'EmpSatisfaction'])
+
+        # one pass over the rows: department x recruitment source counts plus satisfaction sums
+        with phase('aggregate'):
+            grouped = filtered_df1.groupby(['Department', 'RecruitmentSource'], observed=True)['EmpSatisfaction'].agg(['size', 'sum', 'count'])
+
+    with phase('aggregate'):
+        recruitment_counts = grouped['size'].unstack(fill_value=0)  # departments as rows, recruitment sources as columns
+
+        # the average employee satisfaction by department for the text labels, from the per-cell sums
+        by_department = grouped[['sum', 'count']].groupby(level='Department', observed=True).sum()
+        avg_emp_satisfaction = by_department['sum'] / by_department['count']
+        total_heights = recruitment_counts.sum(axis=1)
+
+        # recruitment sources in order of first appearance when walking departments, then sources
+        counts = recruitment_counts.to_numpy()
+        present = counts > 0
+        source_order = []
+        if counts.size:
+            first_department = np.where(present.any(axis=0), present.argmax(axis=0), len(recruitment_counts.index))
+            source_order = [i for i in np.lexsort((np.arange(counts.shape[1]), first_department)) if present[:, i].any()]
+
+    with phase('figure'):
+        # one bar trace per recruitment source column, colored through the figure's colorway
+        departments = recruitment_counts.index.to_numpy()
+        traces = [
+            dict(type='bar', x=departments[present[:, column]], y=counts[present[:, column], column],
+                 name=recruitment_counts.columns[column])
+            for column in source_order
+        ]
+
+        # labels for average satisfaction on top of each department bar, added in one batch
+        annotations = [
+            dict(x=dept, y=int(total_heights[dept]), text=f"{satisfaction:.2f}")
+            for dept, satisfaction in avg_emp_satisfaction.items()
+        ]
+
+    return {'data': traces, 'layout': {'annotations': annotations}}
+
+# callback for updating the line chart
 @app.callback(
-    Output('avg-satisfaction-bar', 'figure'),
+    Output('absences-salary-line', 'figure'),
     [Input('department-dropdown', 'value'),
-     Input('position-dropdown', 'value'),
      Input('performance-dropdown', 'value'),
      Input('gender-dropdown', 'value'),
      Input('employment-status-dropdown', 'value'),
@@ -377,91 +2873,48 @@ def update_gender_pie_chart(department, position, performance, gender, employmen
      Input('age-slider', 'value'),
      Input('satisfaction-checklist', 'value'),
      Input('date-picker-range', 'start_date'),
-     Input('date-picker-range', 'end_date')])
-def update_bar_chart(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date):
-    # start with a copy of the full DataFrame
-    filtered_df1 = df.copy()
-
-    # convert 'DateofHire' to datetime for filtering
-    filtered_df1['DateofHire'] = pd.to_datetime(filtered_df1['DateofHire'])
-
-    # apply filters based on the inputs
-    if department:
-        filtered_df1 = filtered_df1[filtered_df1['Department'].isin(department)]
-    if position:
-        filtered_df1 = filtered_df1[filtered_df1['Position'].isin(position)]
-    if performance:
-        filtered_df1 = filtered_df1[filtered_df1['PerformanceScore'].isin(performance)]
-    if gender:
-        filtered_df1 = filtered_df1[filtered_df1['Sex'] == gender]
-    if employment_status:
-        filtered_df1 = filtered_df1[filtered_df1['EmploymentStatus'].isin(employment_status)]
-    if salary_range:
-        filtered_df1 = filtered_df1[(filtered_df1['Salary'] >= salary_range[0]) & (filtered_df1['Salary'] <= salary_range[1])]
-    if age_range:
-        filtered_df1 = filtered_df1[(filtered_df1['Age'] >= age_range[0]) & (filtered_df1['Age'] <= age_range[1])]
-    if satisfaction:
-        filtered_df1 = filtered_df1[filtered_df1['EmpSatisfaction'].isin(satisfaction)]
-    if start_date and end_date:
-        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
-        filtered_df1 = filtered_df1[(filtered_df1['DateofHire'] >= start_date_obj) & (filtered_df1['DateofHire'] <= end_date_obj)]
-
-    # group by department and recruitment source to calculate counts
-    recruitment_counts = filtered_df1.groupby(['Department', 'RecruitmentSource']).size().reset_index(name='Counts')
-    
-    # calculate the average employee satisfaction by department for the text labels
-    avg_emp_satisfaction = filtered_df1.groupby('Department')['EmpSatisfaction'].mean().reset_index()
-    recruitment_counts = recruitment_counts.merge(avg_emp_satisfaction, on='Department')
-
-    # colors for bars - more shades of purple
-    colors = ['#6a3d9a', '#7b68ee', '#8a2be2', '#9932cc', '#ba55d3']  # Richer purple shades
-
-    # create the plot
-    fig = go.Figure()
-    for i, source in enumerate(recruitment_counts['RecruitmentSource'].unique()):
-        df_source = recruitment_counts[recruitment_counts['RecruitmentSource'] == source]
-        fig.add_trace(go.Bar(
-            x=df_source['Department'],
-            y=df_source['Counts'],
-            name=source,
-            marker_color=colors[i % len(colors)]
-        ))
-
-    # customize the layout
-    fig.update_layout(
-        barmode='stack',
-        title='Recruitment by Department, with Avg. Dept. Satisfaction at the Top',
-        yaxis=dict(title='Number of People Recruited'),
-        xaxis=dict(title='Department'),
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='#CCCCCC',  # consistent light gray background
-        font=dict(color='#4b2e83'),
-        legend_title_text='Recruitment Source',
-        showlegend=True
-    )
+     Input('date-picker-range', 'end_date')],
+    [State('session-id', 'data'),
+     State('dataset', 'data')])
+@instrumented
+def update_absences_line_chart(department, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date,
+                               session_id=None, dataset=None):
+    # this chart has no position filter
+    spec = FilterSpec.from_inputs(department, None, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date)
+    with using_dataset(dataset), latest_request(session_id, 'absences-salary-line'):
+        return figure_patch(cached_figure('absences-salary-line', spec, absences_line_chart))
 
-    # add labels for average satisfaction on top of each department bar
-    for dept in avg_emp_satisfaction['Department']:
-        dept_data = avg_emp_satisfaction[avg_emp_satisfaction['Department'] == dept]
-        total_height = recruitment_counts[recruitment_counts['Department'] == dept]['Counts'].sum()
-        fig.add_annotation(
-            x=dept,
-            y=total_height,
-            text=f"{dept_data['EmpSatisfaction'].values[0]:.2f}",
-            showarrow=False,
-            font=dict(color='white', size=14),
-            bgcolor='#4b2e83',
-            bordercolor='white',
-            borderwidth=2
-        )
 
-    return fig
+# absences by rounded salary line trace for the employees matching `spec`
+def absences_line_chart(spec):
+    cells = cube_cells(spec)
+    if cells is not None:
+        # the cube is already bucketed by rounded salary
+        with phase('aggregate'):
+            sums = cells.groupby('SalaryRounded')[['Absences_sum', 'Absences_n']].sum()
+            grouped = sums['Absences_sum'] / sums['Absences_n']
+    else:
+        # filter the DataFrame
+        filtered_df3 = filtered_employees(spec, ['Salary', 'Absences'])
 
-# callback for updating the line chart
+        with phase('aggregate'):
+            # round salary to the nearest $10,000
+            filtered_df3['Salary Rounded'] = salary_rounded(filtered_df3['Salary'])
+
+            # group by the rounded salary
+            grouped = filtered_df3.groupby('Salary Rounded')['Absences'].mean()
+
+    with phase('figure'):
+        # create the line trace
+        line = dict(type='scatter', x=grouped.index.to_numpy(), y=grouped.to_numpy())
+
+    return {'data': [line]}
+
+# callback for updating the headcount chart
 @app.callback(
-    Output('absences-salary-line', 'figure'),
+    Output('headcount-trend', 'figure'),
     [Input('department-dropdown', 'value'),
+     Input('position-dropdown', 'value'),
      Input('performance-dropdown', 'value'),
      Input('gender-dropdown', 'value'),
      Input('employment-status-dropdown', 'value'),
@@ -469,51 +2922,46 @@ def update_bar_chart(department, position, performance, gender, employment_statu
      Input('age-slider', 'value'),
      Input('satisfaction-checklist', 'value'),
      Input('date-picker-range', 'start_date'),
-     Input('date-picker-range', 'end_date')])
-def update_absences_line_chart(department, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date):
-    # filter the DataFrame
-    filtered_df3 = df.copy()
-
-    # convert 'DateofHire' to datetime for filtering
-    filtered_df3['DateofHire'] = pd.to_datetime(filtered_df3['DateofHire'])
-
-    if department:
-        filtered_df3 = filtered_df3[filtered_df3['Department'].isin(department)]
-    if performance:
-        filtered_df3 = filtered_df3[filtered_df3['PerformanceScore'].isin(performance)]
-    if gender:
-        filtered_df3 = filtered_df3[filtered_df3['Sex'] == gender]
-    if employment_status:
-        filtered_df3 = filtered_df3[filtered_df3['EmploymentStatus'].isin(employment_status)]
-    if salary_range:
-        filtered_df3 = filtered_df3[(filtered_df3['Salary'] >= salary_range[0]) & (filtered_df3['Salary'] <= salary_range[1])]
-    if age_range:
-        filtered_df3 = filtered_df3[(filtered_df3['Age'] >= age_range[0]) & (filtered_df3['Age'] <= age_range[1])]
-    if satisfaction:
-        filtered_df3 = filtered_df3[filtered_df3['EmpSatisfaction'].isin(satisfaction)]
-    if start_date and end_date:
-        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
-        filtered_df3 = filtered_df3[(filtered_df3['DateofHire'] >= start_date_obj) & (filtered_df3['DateofHire'] <= end_date_obj)]
-
-    # round salary to the nearest $10,000
-    filtered_df3['Salary Rounded'] = (np.round(filtered_df3['Salary'] / 10000) * 10000).astype(int)
-
-    # group by the rounded salary
-    grouped = filtered_df3.groupby('Salary Rounded')['Absences'].mean().reset_index()
-
-    # create the line chart
-    colors = ['#6a3d9a', '#7b68ee', '#9a32cd', '#9370db', '#A9A9A9']  # purple shades and one gray
-    fig = px.line(grouped, x='Salary Rounded', y='Absences',
-                  labels={'Salary Rounded': 'Salary Rounded to Nearest $10k', 'Absences': 'Average Number of Absences'},
-                  title='Absences vs. Rounded Salary',
-                  color_discrete_sequence=colors)  # using the custom colors
-    fig.update_layout(plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='#CCCCCC', font=dict(color='#4b2e83'))
-
-    return fig
+     Input('date-picker-range', 'end_date')],
+    [State('session-id', 'data'),
+     State('dataset', 'data')])
+@instrumented
+def update_headcount_chart(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date,
+                           session_id=None, dataset=None):
+    spec = FilterSpec.from_inputs(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date)
+    with using_dataset(dataset), latest_request(session_id, 'headcount-trend'):
+        return figure_patch(cached_figure('headcount-trend', spec, headcount_chart))
+
+
+# monthly headcount, hire and termination traces for the employees matching `spec`
+def headcount_chart(spec):
+    index = headcount_index(snapshot())
+    # the date range is the chart's time window here, not a filter on hire dates
+    rows = filter_rows(replace(spec, start_date=None, end_date=None))
+
+    with phase('aggregate'):
+        span = index.span()
+        if spec.start_date:
+            span = [int(pd.Timestamp(day).to_datetime64().astype('datetime64[D]').astype(np.int64)) for day in (spec.start_date, spec.end_date)]
+        if span is None or span[0] > span[1]:
+            return {'data': []}
+        months, edges = month_edges(*span)
+        hires, terminations, headcount = index.counts(rows, edges)
+        starting = headcount[:-1]
+        attrition = np.divide(terminations * 100, starting, out=np.full(len(starting), np.nan), where=starting > 0)
+
+    with phase('figure'):
+        traces = [
+            dict(type='scatter', x=months, y=headcount[1:]),
+            dict(type='bar', x=months, y=hires),
+            dict(type='bar', x=months, y=terminations, customdata=attrition),
+        ]
+
+    return {'data': traces}
 
 @app.callback(
-    Output('employee-data-table', 'data'),
+    [Output('employee-table-page', 'data'),
+     Output('employee-data-table', 'page_count')],
     [Input('department-dropdown', 'value'),
      Input('position-dropdown', 'value'),
      Input('performance-dropdown', 'value'),
@@ -523,35 +2971,365 @@ def update_absences_line_chart(department, performance, gender, employment_statu
      Input('age-slider', 'value'),
      Input('satisfaction-checklist', 'value'),
      Input('date-picker-range', 'start_date'),
-     Input('date-picker-range', 'end_date')])
-def update_data_table(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date):
-    # copying the dataframe and converting DateofHire to datetime
-    filtered_df4 = df.copy()
-    filtered_df4['DateofHire'] = pd.to_datetime(filtered_df4['DateofHire'])
-    filtered_df4['DOB'] = pd.to_datetime(filtered_df4['DOB']).dt.strftime('%Y-%m-%d')
-
-    # apply filters based on the inputs
-    if department:
-        filtered_df4 = filtered_df4[filtered_df4['Department'].isin(department)]
-    if position:
-        filtered_df4 = filtered_df4[filtered_df4['Position'].isin(position)]
-    if performance:
-        filtered_df4 = filtered_df4[filtered_df4['PerformanceScore'].isin(performance)]
-    if gender:
-        filtered_df4 = filtered_df4[filtered_df4['Sex'] == gender]
-    if employment_status:
-        filtered_df4 = filtered_df4[filtered_df4['EmploymentStatus'].isin(employment_status)]
-    if salary_range:
-        filtered_df4 = filtered_df4[(filtered_df4['Salary'] >= salary_range[0]) & (filtered_df4['Salary'] <= salary_range[1])]
-    if age_range:
-        filtered_df4 = filtered_df4[(filtered_df4['Age'] >= age_range[0]) & (filtered_df4['Age'] <= age_range[1])]
-    if satisfaction:
-        filtered_df4 = filtered_df4[filtered_df4['EmpSatisfaction'].isin(satisfaction)]
-    if start_date and end_date:
-        filtered_df4 = filtered_df4[(filtered_df4['DateofHire'] >= start_date) & (filtered_df4['DateofHire'] <= end_date)]
-
-    # returning data for the DataTable
-    return filtered_df4.to_dict('records')
+     Input('date-picker-range', 'end_date'),
+     Input('employee-data-table', 'page_current'),
+     Input('employee-data-table', 'page_size'),
+     Input('employee-data-table', 'sort_by'),
+     Input('employee-data-table', 'filter_query')],
+    [State('session-id', 'data'),
+     State('dataset', 'data')])
+@instrumented
+def update_data_table(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date,
+                      page_current, page_size, sort_by, filter_query, session_id=None, dataset=None):
+    # rows matching the selected filters, narrowed, sorted and paged by the table itself
+    spec = FilterSpec.from_inputs(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date)
+
+    # returning only the visible page for the DataTable, as columns turned back into rows in the browser
+    with using_dataset(dataset), latest_request(session_id, 'employee-data-table'):
+        return cached_table_page(spec, filter_query, sort_by, page_current, page_size)
+
+# %% [markdown]
+# ### Session Snapshots
+#
+# Reloading the page, or coming back to a tab the browser had discarded, used to start again from the default filters
+# and run every callback for them. Each tab now keeps its filters in a session `dcc.Store`: per dataset, the canonical
+# filter state, the table's page, sort and query, and the digests the results of those settings are cached under. A
+# reload restores the filters and fills the charts and the table page with the results still in the figure cache (or its
+# shared directory), so the page arrives complete. The callbacks then fired for the restored filters find the same
+# results in the cache. Digests are only followed while the data version they were made for is current; after a data
+# refresh the filters are restored but the results are computed again, and the new digests replace the stale ones.
+
+# %%
+# filter fields with the component property each is picked with
+FILTER_COMPONENTS = [('department', 'department-dropdown', 'value'), ('position', 'position-dropdown', 'value'),
+                     ('performance', 'performance-dropdown', 'value'), ('gender', 'gender-dropdown', 'value'),
+                     ('employment_status', 'employment-status-dropdown', 'value'), ('salary_range', 'salary-slider', 'value'),
+                     ('age_range', 'age-slider', 'value'), ('satisfaction', 'satisfaction-checklist', 'value'),
+                     ('start_date', 'date-picker-range', 'start_date'), ('end_date', 'date-picker-range', 'end_date')]
+
+# outputs answered from the figure cache: the property each fills, and the filters its callback leaves out of its spec
+CACHED_OUTPUTS = {
+    'salary-engagement-scatter': ('figure', ('start_date', 'end_date')),
+    'average-salary-display': ('children', ('start_date', 'end_date')),
+    'widget-rows': ('data', ('start_date', 'end_date')),
+    'gender-pie-chart': ('figure', ()),
+    'avg-satisfaction-bar': ('figure', ()),
+    'absences-salary-line': ('figure', ('position',)),
+    'headcount-trend': ('figure', ()),
+}
+
+
+# the outputs of CACHED_OUTPUTS with a server callback; with clientside widgets the average salary and pie have none
+def server_cached_outputs():
+    # a callback with several outputs is registered as ..first.prop...second.prop..
+    served = {output for key, registered in app.callback_map.items() if 'callback' in registered for output in key.strip('.').split('...')}
+    return [output for output, (prop, ignored) in CACHED_OUTPUTS.items() if f'{output}.{prop}' in served]
+
+
+# `figure` with the traces and layout parts of a cached chart update, as figure_patch would leave it
+def filled_figure(figure, update):
+    figure = figure.to_plotly_json()
+    figure['data'] = update['data']
+    figure['layout'] = {**figure.get('layout', {}), **update.get('layout', {})}
+    return figure
+
+
+# copy of `component` with `props[id]` set on the components of those ids; components are copied shallowly, so the
+# cached page they come from is left as it is
+def with_props(component, props):
+    component = copy.copy(component)
+    for prop, value in props.get(getattr(component, 'id', None), {}).items():
+        setattr(component, prop, value)
+    children = getattr(component, 'children', None)
+    if isinstance(children, (list, tuple)):
+        component.children = [with_props(child, props) if isinstance(child, Component) else child for child in children]
+    elif isinstance(children, Component):
+        component.children = with_props(children, props)
+    return component
+
+
+# whether `value` has the shape filter `field` takes from its component
+def valid_filter(field, value):
+    if field == 'gender':
+        return isinstance(value, str)
+    if field in ('salary_range', 'age_range'):
+        return isinstance(value, list) and len(value) == 2 and all(isinstance(bound, (int, float)) and not isinstance(bound, bool) for bound in value)
+    if field in ('start_date', 'end_date'):
+        return isinstance(value, str) and re.fullmatch(r'\d{4}-\d{2}-\d{2}', value[:10]) is not None
+    return isinstance(value, list) and all(isinstance(item, (str, int)) and not isinstance(item, bool) for item in value)
+
+
+# whether `sort_by` has the shape of the table's sort_by, on table columns
+def valid_sort_by(sort_by):
+    return isinstance(sort_by, list) and all(isinstance(item, dict) and item.get('column_id') in TABLE_COLUMN_IDS and item.get('direction') in ('asc', 'desc')
+                                             for item in sort_by)
+
+
+# a tab's saved state for one dataset with everything that does not fit its shape dropped, or None; the browser keeps
+# the state, so none of it is trusted
+def session_entry(state):
+    if not isinstance(state, dict) or not isinstance(state.get('version'), str):
+        return None
+    filters = state.get('filters') if isinstance(state.get('filters'), dict) else {}
+    table = state.get('table') if isinstance(state.get('table'), dict) else {}
+    results = state.get('results') if isinstance(state.get('results'), dict) else {}
+
+    entry = {'version': state['version'], 'filters': {}, 'table': {}, 'results': {}}
+    for field, component, prop in FILTER_COMPONENTS:
+        if filters.get(field) is not None and valid_filter(field, filters[field]):
+            entry['filters'][field] = filters[field]
+    if isinstance(table.get('page_current'), int) and not isinstance(table['page_current'], bool) and table['page_current'] >= 0:
+        entry['table']['page_current'] = table['page_current']
+    if isinstance(table.get('filter_query'), str):
+        entry['table']['filter_query'] = table['filter_query']
+    sort_by = table.get('sort_by')
+    if valid_sort_by(sort_by):
+        entry['table']['sort_by'] = [{'column_id': item['column_id'], 'direction': item['direction']} for item in sort_by]
+    for output, digest in results.items():
+        if (output in CACHED_OUTPUTS or output == 'employee-data-table') and isinstance(digest, str) and DIGEST_PATTERN.fullmatch(digest):
+            entry['results'][output] = digest
+    return entry
+
+
+# whether a cached `value` can fill property `prop`
+def fits_prop(prop, value):
+    if prop == 'figure':
+        return isinstance(value, dict) and isinstance(value.get('data'), list) and isinstance(value.get('layout', {}), dict)
+    if prop == 'children':
+        return isinstance(value, str)
+    return isinstance(value, dict)
+
+
+# component props that put the page of snapshot `data` back into a tab's saved `state`, as cleaned by session_entry
+def restored_props(data, state):
+    props = {}
+    filters = state['filters']
+    for field, component, prop in FILTER_COMPONENTS:
+        # a filter missing from the canonical state is at the page's default
+        if filters.get(field) is not None:
+            props.setdefault(component, {})[prop] = filters[field]
+    # the selected positions stay among the offered ones
+    props.setdefault('position-dropdown', {})['options'] = dropdown_options(data, 'Position', None, filters.get('position'),
+                                                                          {'Department': filters.get('department')})
+    props['employee-data-table'] = dict(state['table'])
+
+    # results of another data version are stale
+    if state['version'] != data.version:
+        return props
+    results = state['results']
+    found = current_dataset().figure_cache.find(results.values())
+    for output, (prop, ignored) in CACHED_OUTPUTS.items():
+        value = found.get(results.get(output))
+        if value is not None and fits_prop(prop, value):
+            if prop == 'figure':
+                value = filled_figure(FIGURE_TEMPLATES[output], value)
+            props.setdefault(output, {})[prop] = value
+    page = found.get(results.get('employee-data-table'))
+    if isinstance(page, (tuple, list)) and len(page) == 2 and isinstance(page[0], dict) and isinstance(page[1], int):
+        props['employee-table-page'] = {'data': page[0]}
+        props['employee-data-table']['page_count'] = page[1]
+    return props
+
+
+# callback keeping the tab's session state in step with its filters and table settings
+@app.callback(
+    Output('session-state', 'data'),
+    [Input('department-dropdown', 'value'),
+     Input('position-dropdown', 'value'),
+     Input('performance-dropdown', 'value'),
+     Input('gender-dropdown', 'value'),
+     Input('employment-status-dropdown', 'value'),
+     Input('salary-slider', 'value'),
+     Input('age-slider', 'value'),
+     Input('satisfaction-checklist', 'value'),
+     Input('date-picker-range', 'start_date'),
+     Input('date-picker-range', 'end_date'),
+     Input('employee-data-table', 'page_current'),
+     Input('employee-data-table', 'page_size'),
+     Input('employee-data-table', 'sort_by'),
+     Input('employee-data-table', 'filter_query')],
+    [State('dataset', 'data')])
+@instrumented
+def remember_session_state(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date,
+                           page_current, page_size, sort_by, filter_query, dataset=None):
+    spec = FilterSpec.from_inputs(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date)
+    with using_dataset(dataset) as current, pinned_snapshot() as data:
+        window, spec = spec, canonical_spec(spec)
+        results = {}
+        for output in server_cached_outputs():
+            ignored = CACHED_OUTPUTS[output][1]
+            results[output] = result_digest(figure_key(output, data, replace(window, **dict.fromkeys(ignored))))
+        results['employee-data-table'] = result_digest(table_page_key(data, spec, filter_query, sort_by, page_current, page_size))
+
+        # only this dataset's entry is sent, the tab's other datasets keep theirs; the picked dates are kept even when
+        # they cover every hire, as the headcount chart's window
+        patched = Patch()
+        patched[current.name] = {
+            'version': data.version,
+            'filters': asdict(replace(spec, start_date=window.start_date, end_date=window.end_date)),
+            'table': {'page_current': page_current or 0, 'sort_by': sort_by or [], 'filter_query': filter_query or ''},
+            'results': results,
+        }
+        return patched
+
+# %% [markdown]
+# ### Streaming Export
+#
+# The employee table can be downloaded as it is currently filtered and sorted. `/export.csv` and `/export.parquet` take
+# the same filter state the callbacks use, plus the table's own filter query and sort, and stream the matching rows
+# `HR_EXPORT_CHUNK_ROWS` at a time: as a chunked CSV response, or as one Parquet row group per chunk. Only one chunk of
+# records is formatted at a time, however large the export. Parquet needs the optional `pyarrow` package.
+#
+# A download holds the thread serving it until its last chunk is sent. Large exports therefore need threaded or
+# asynchronous gunicorn workers (`--worker-class gthread --threads 8`, or gevent): a sync worker serves nothing else for
+# as long as a download runs.
+
+# %%
+# rows formatted and sent at a time
+EXPORT_CHUNK_ROWS = int(os.environ.get('HR_EXPORT_CHUNK_ROWS', 50000))
+
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+
+# query string of an export link for a filter state, table query and sort of a dataset
+def export_query(spec, filter_query, sort_by, dataset=None):
+    return urllib.parse.urlencode({
+        'dataset': dataset or DEFAULT_DATASET,
+        'filters': json.dumps(asdict(spec)),
+        'filter_query': filter_query or '',
+        'sort_by': json.dumps([{'column_id': item['column_id'], 'direction': item['direction']} for item in sort_by or []]),
+    })
+
+
+# filter state, table query and sort of an export request's query string; a ValueError for anything that is not the
+# shape of the link export_query writes, since the query string can be edited
+def export_request(args):
+    filters = json.loads(args.get('filters') or '{}')
+    sort_by = json.loads(args.get('sort_by') or '[]')
+    if not isinstance(filters, dict) or not valid_sort_by(sort_by):
+        raise ValueError('malformed export request')
+    for field, value in filters.items():
+        if field not in FilterSpec.__dataclass_fields__ or (value is not None and not valid_filter(field, value)):
+            raise ValueError(f'malformed export filter: {field}')
+        if field in ('start_date', 'end_date') and value is not None:
+            pd.Timestamp(value)
+    sort_by = [{'column_id': item['column_id'], 'direction': item['direction']} for item in sort_by]
+    return FilterSpec.from_inputs(**filters), args.get('filter_query') or None, sort_by
+
+
+# the table columns of snapshot `data` at `rows`, one chunk at a time (an empty result is one empty chunk)
+def export_chunks(data, rows):
+    for start in range(0, max(len(rows), 1), EXPORT_CHUNK_ROWS):
+        yield table_frame(data, rows[start:start + EXPORT_CHUNK_ROWS])
+
+
+def csv_stream(chunks):
+    for number, chunk in enumerate(chunks):
+        yield chunk.to_csv(index=False, header=number == 0, date_format='%Y-%m-%d').encode()
+
+
+# a write-only file that hands back what was written to it since the last `drain()`
+class _ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        written = b''.join(self.parts)
+        self.parts = []
+        return written
+
+
+def parquet_stream(chunks):
+    sink = _ChunkSink()
+    writer = None
+    for chunk in chunks:
+        # every row group has the first chunk's schema, even where a later chunk has only missing values
+        table = pyarrow.Table.from_pandas(chunk, schema=writer.schema if writer else None, preserve_index=False)
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+@server.route('/export.<kind>')
+def export_employees(kind):
+    if kind not in EXPORT_MIMETYPES:
+        flask.abort(404)
+    if kind == 'parquet' and pyarrow is None:
+        flask.abort(501, 'Parquet export needs pyarrow')
+    name = flask.request.args.get('dataset') or DEFAULT_DATASET
+    if name not in DATASETS:
+        flask.abort(404)
+    try:
+        spec, filter_query, sort_by = export_request(flask.request.args)
+    except (ValueError, TypeError, KeyError):
+        flask.abort(400)
+
+    # the rows are ordered now; their records are read from this snapshot while the response streams
+    with using_dataset(name), pinned_snapshot() as data:
+        rows = table_rows(data, spec, filter_query, sort_by)
+    chunks = export_chunks(data, rows)
+    return flask.Response(
+        csv_stream(chunks) if kind == 'csv' else parquet_stream(chunks),
+        mimetype=EXPORT_MIMETYPES[kind],
+        headers={'Content-Disposition': f'attachment; filename=employees.{kind}'},
+    )
+
+
+# callback pointing the export links at the table as currently filtered and sorted
+@app.callback(
+    [Output('export-csv-link', 'href'),
+     Output('export-parquet-link', 'href')],
+    [Input('department-dropdown', 'value'),
+     Input('position-dropdown', 'value'),
+     Input('performance-dropdown', 'value'),
+     Input('gender-dropdown', 'value'),
+     Input('employment-status-dropdown', 'value'),
+     Input('salary-slider', 'value'),
+     Input('age-slider', 'value'),
+     Input('satisfaction-checklist', 'value'),
+     Input('date-picker-range', 'start_date'),
+     Input('date-picker-range', 'end_date'),
+     Input('employee-data-table', 'sort_by'),
+     Input('employee-data-table', 'filter_query')],
+    [State('dataset', 'data')])
+@instrumented
+def update_export_links(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date,
+                        sort_by, filter_query, dataset=None):
+    spec = FilterSpec.from_inputs(department, position, performance, gender, employment_status, salary_range, age_range, satisfaction, start_date, end_date)
+    query = export_query(spec, filter_query, sort_by, dataset)
+    return app.get_relative_path(f'/export.csv?{query}'), app.get_relative_path(f'/export.parquet?{query}')
+
+# %%
+# with metrics on, every callback handler is timed as a whole and the timings are served at /metrics
+if METRICS_ENABLED:
+    # clientside callbacks have no server handler
+    for registered in app.callback_map.values():
+        if 'callback' in registered:
+            registered['callback'] = timed_dispatch(registered['callback'])
+
+    @server.route('/metrics')
+    def metrics():
+        caches = {(name, cache): memo for name, dataset in list(datasets.loaded.items()) for cache, memo in dataset.caches().items()}
+        counters = [('hr_requests_dropped_total', 'Requests that gave way to a newer one from the same page.', request_tracker.dropped),
+                    ('hr_datasets_unloaded_total', 'Datasets unloaded to stay within the memory budget.', datasets.evicted),
+                    ('hr_session_results_restored_total', 'Cached results given back to reloaded pages.',
+                     sum(dataset.figure_cache.restored for dataset in list(datasets.loaded.values())))]
+        return flask.Response(metrics_text(caches, counters), mimetype='text/plain; version=0.0.4')
 
 # run the app
 if __name__ == '__main__':
@@ -0,0 +1,123 @@
+// clientside versions of the average salary display and the gender pie chart, used when HR_CLIENTSIDE_WIDGETS=1,
+// and the rows of the employee table page, which the server sends as columns
+(function () {
+    // decoded snapshot columns, kept until the data version changes
+    var decoded = {version: null};
+
+    // bytes of a base64 string
+    function bytes(encoded) {
+        var binary = atob(encoded);
+        var out = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; i++) {
+            out[i] = binary.charCodeAt(i);
+        }
+        return out;
+    }
+
+    // whether a selection refers to the rows of this snapshot; after a data refresh the page keeps its old snapshot
+    function current(snapshot, selection) {
+        return Boolean(snapshot && selection) && selection.version === snapshot.version;
+    }
+
+    function columns(snapshot) {
+        if (decoded.version !== snapshot.version || !decoded.salary) {
+            decoded = {
+                version: snapshot.version,
+                salary: new Int32Array(bytes(snapshot.salary).buffer),
+                sex: new Int8Array(bytes(snapshot.sex).buffer),
+                hired: new Int32Array(bytes(snapshot.hired).buffer)
+            };
+        }
+        return decoded;
+    }
+
+    // call visit(row) for every row in a selection sent by the server
+    function eachRow(selection, nRows, visit) {
+        var data = bytes(selection.data);
+        if (selection.kind === 'rows') {
+            var rows = new Int32Array(data.buffer);
+            for (var i = 0; i < rows.length; i++) {
+                visit(rows[i]);
+            }
+            return;
+        }
+        for (var row = 0; row < nRows; row++) {
+            if (data[row >> 3] & (128 >> (row & 7))) {
+                visit(row);
+            }
+        }
+    }
+
+    // days since 1970-01-01 for a date picker value
+    function day(value) {
+        return Math.floor(Date.parse(String(value).slice(0, 10)) / 86400000);
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        hr: {
+            average_salary: function (snapshot, selection) {
+                if (!current(snapshot, selection)) {
+                    return window.dash_clientside.no_update;
+                }
+                var cols = columns(snapshot);
+                var total = 0;
+                var count = 0;
+                eachRow(selection, cols.salary.length, function (row) {
+                    total += cols.salary[row];
+                    count += 1;
+                });
+                return '$' + (total / count / 1000).toFixed(1) + 'k';
+            },
+
+            gender_pie: function (snapshot, selection, startDate, endDate, figure) {
+                if (!current(snapshot, selection)) {
+                    return window.dash_clientside.no_update;
+                }
+                var cols = columns(snapshot);
+                // a date range only applies once both ends are picked
+                var ranged = Boolean(startDate && endDate);
+                var start = ranged ? day(startDate) : 0;
+                var end = ranged ? day(endDate) : 0;
+
+                // slices in order of first appearance so each keeps its color
+                var counts = {};
+                var order = [];
+                eachRow(selection, cols.sex.length, function (row) {
+                    var code = cols.sex[row];
+                    if (code < 0 || (ranged && (cols.hired[row] < start || cols.hired[row] > end))) {
+                        return;
+                    }
+                    if (!(code in counts)) {
+                        counts[code] = 0;
+                        order.push(code);
+                    }
+                    counts[code] += 1;
+                });
+
+                var pie = {
+                    type: 'pie',
+                    labels: order.map(function (code) { return snapshot.sex_labels[code]; }),
+                    values: order.map(function (code) { return counts[code]; }),
+                    marker: {colors: snapshot.pie_colors}
+                };
+                return Object.assign({}, figure, {data: [pie]});
+            },
+
+            table_records: function (page) {
+                if (!page) {
+                    return window.dash_clientside.no_update;
+                }
+                var count = page.data.length ? page.data[0].length : 0;
+                var records = [];
+                for (var row = 0; row < count; row++) {
+                    var record = {};
+                    for (var column = 0; column < page.columns.length; column++) {
+                        record[page.columns[column]] = page.data[column][row];
+                    }
+                    records.push(record);
+                }
+                return records;
+            }
+        }
+    });
+})();
@@ -0,0 +1,340 @@
+# %% [markdown]
+# ## HR Dashboard Benchmarks
+#
+# `data/data.csv` has 311 employees, which says little about how the dashboard behaves for a large company. This script
+# writes synthetic employee files of any size that keep the schema and the distributions of `data.csv`, loads each one
+# into the app in its own process (through `HR_DATA_PATH`), calls every callback function directly over a seeded mix of
+# filter states, and prints throughput, latency percentiles, peak memory and JSON encoding costs as JSON.
+#
+#     python benchmark.py --rows 100000 --rows 1000000 --output benchmark.json
+#     python benchmark.py generate --rows 10000000 --output data/synthetic.csv
+
+# %%
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'data.csv')
+LATENCY_QUANTILES = (0.5, 0.95, 0.99)
+
+# %% [markdown]
+# ### Synthetic Employees
+#
+# Whole rows of `data.csv` are drawn with replacement, so every categorical column keeps its distribution and its
+# co-occurrence with the others (positions stay within their departments, managers with their teams). Salaries,
+# engagement scores and dates are then jittered so the numeric columns are not just copies, and every employee gets a
+# unique id and name.
+
+# %%
+# rows written per chunk, so that millions of employees never sit in memory as python strings at once
+GENERATE_CHUNK_ROWS = 500000
+
+
+# `n_rows` synthetic employees drawn from `source`, reproducible for a given seed
+def synthetic_employees(source, n_rows, rng, first_id=0):
+    frame = source.iloc[rng.integers(0, len(source), n_rows)].reset_index(drop=True)
+    ids = np.arange(first_id, first_id + n_rows)
+
+    frame['EmpID'] = 100000 + ids
+    frame['Employee_Name'] = [f'Employee {i:08d}' for i in ids]
+    frame['Salary'] = np.round(frame['Salary'] * rng.lognormal(0, 0.05, n_rows)).astype(int)
+    frame['EngagementSurvey'] = np.clip(frame['EngagementSurvey'] + rng.normal(0, 0.1, n_rows), 1, 5).round(2)
+
+    # hire, termination and review dates move together so their order is kept
+    career_shift = pd.to_timedelta(rng.integers(-180, 181, n_rows), unit='D')
+    birth_shift = pd.to_timedelta(rng.integers(-365, 366, n_rows), unit='D')
+    for column, shift, date_format in [('DateofHire', career_shift, '%Y-%m-%d'),
+                                       ('DateofTermination', career_shift, '%Y-%m-%d 00:00:00'),
+                                       ('LastPerformanceReview_Date', career_shift, '%Y-%m-%d'),
+                                       ('DOB', birth_shift, '%Y-%m-%d')]:
+        dates = pd.to_datetime(frame[column].str.slice(0, 10), format='%Y-%m-%d', errors='coerce') + shift
+        # missing dates keep their original spelling, e.g. 'N/A' for employees still employed
+        frame[column] = dates.dt.strftime(date_format).where(dates.notna(), frame[column])
+    return frame
+
+
+# write `n_rows` synthetic employees in the layout of `data.csv` to `path`
+def generate(path, n_rows, seed=0, source_path=SOURCE_PATH):
+    source = pd.read_csv(source_path, dtype=str, keep_default_na=False)
+    # numeric columns are parsed only where they are jittered
+    source['Salary'] = pd.to_numeric(source['Salary'])
+    source['EngagementSurvey'] = pd.to_numeric(source['EngagementSurvey'])
+    rng = np.random.default_rng(seed)
+
+    staging = f'{path}.partial'
+    for start in range(0, n_rows, GENERATE_CHUNK_ROWS):
+        chunk = synthetic_employees(source, min(GENERATE_CHUNK_ROWS, n_rows - start), rng, first_id=start)
+        chunk.to_csv(staging, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+    os.replace(staging, path)
+    return path
+
+# %% [markdown]
+# ### Filter States
+#
+# Each state is one set of sidebar inputs, picked the way people use the dashboard: mostly the defaults or one or two
+# departments, sometimes a position, a demographic, a narrower slider or a hire date window, and sometimes several of
+# those together.
+
+# %%
+FILTER_MIX = {
+    'default': 0.2,
+    'department': 0.2,
+    'position': 0.1,
+    'demographic': 0.1,
+    'salary': 0.1,
+    'age': 0.05,
+    'satisfaction': 0.05,
+    'dates': 0.1,
+    'combined': 0.1,
+}
+
+
+# a sub-range of [low, high] covering between a tenth and all of it
+def sub_range(rng, low, high):
+    width = (high - low) * rng.uniform(0.1, 1.0)
+    start = low + (high - low - width) * rng.uniform()
+    return [start, start + width]
+
+
+# `count` filter states over the app's data, as keyword arguments for the callbacks
+def filter_states(app, count, rng):
+    frame = app.snapshot().df
+    defaults = dict(department=None, position=None, performance=None, gender=None, employment_status=None,
+                    salary_range=[frame['Salary'].min(), frame['Salary'].max()],
+                    age_range=[frame['Age'].min(), frame['Age'].max()],
+                    satisfaction=list(frame['EmpSatisfaction'].unique()),
+                    start_date=frame['DateofHire'].min().strftime('%Y-%m-%d'),
+                    end_date=frame['DateofHire'].max().strftime('%Y-%m-%d'))
+
+    def pick(column, most):
+        values = frame[column].dropna().unique()
+        return list(rng.choice(values, size=min(len(values), rng.integers(1, most + 1)), replace=False))
+
+    def hire_window():
+        first, last = frame['DateofHire'].min().value, frame['DateofHire'].max().value
+        start, end = sub_range(rng, first, last)
+        return pd.Timestamp(int(start)).strftime('%Y-%m-%d'), pd.Timestamp(int(end)).strftime('%Y-%m-%d')
+
+    kinds = rng.choice(list(FILTER_MIX), size=count, p=list(FILTER_MIX.values()))
+    states = []
+    for kind in kinds:
+        state = dict(defaults)
+        if kind in ('department', 'combined'):
+            state['department'] = pick('Department', 2)
+        if kind == 'position':
+            state['position'] = pick('Position', 3)
+        if kind == 'demographic':
+            state['gender'] = pick('Sex', 1)[0]
+            state['performance'] = pick('PerformanceScore', 2)
+        if kind in ('salary', 'combined'):
+            state['salary_range'] = sub_range(rng, *defaults['salary_range'])
+        if kind == 'age':
+            state['age_range'] = sub_range(rng, *defaults['age_range'])
+        if kind in ('satisfaction', 'combined'):
+            state['satisfaction'] = pick('EmpSatisfaction', 4)
+        if kind in ('dates', 'combined'):
+            state['start_date'], state['end_date'] = hire_window()
+        states.append((str(kind), state))
+    return states
+
+# %% [markdown]
+# ### Measuring the Callbacks
+#
+# Every callback is called once per state with the app's caches emptied first ("cold", what a new filter state costs)
+# and once more straight after ("warm", what a repeated state costs). The timings include turning the result into the
+# JSON that Dash would send. A separate cold pass runs under tracemalloc for the peak memory of the callbacks.
+
+# %%
+# the callbacks of the app and how to call each with a filter state
+def callback_calls(app):
+    def table(state):
+        return app.update_data_table(**state, page_current=0, page_size=app.TABLE_PAGE_SIZE, sort_by=[], filter_query='')
+
+    calls = {
+        'update_scatter_plot': lambda state: app.update_scatter_plot(**state),
+        'update_bar_chart': lambda state: app.update_bar_chart(**state),
+        'update_absences_line_chart': lambda state: app.update_absences_line_chart(
+            **{key: value for key, value in state.items() if key != 'position'}),
+        'update_data_table': table,
+        'update_headcount_chart': lambda state: app.update_headcount_chart(**state),
+    }
+    without_dates = lambda state: {key: value for key, value in state.items() if key not in ('start_date', 'end_date')}
+    if app.CLIENTSIDE_WIDGETS:
+        # the page already holds the current columns, so only the rows are sent
+        calls['update_widget_rows'] = lambda state: app.update_widget_rows(**without_dates(state), widget_version=app.snapshot().version)[0]
+    else:
+        calls['update_average_salary'] = lambda state: app.update_average_salary(**without_dates(state))
+        calls['update_gender_pie_chart'] = lambda state: app.update_gender_pie_chart(**state)
+    return calls
+
+
+def clear_caches(app):
+    for memo in app.current_dataset().caches().values():
+        memo.clear()
+
+
+# count, throughput and latency percentiles in milliseconds for a list of timings in seconds
+def latency_summary(seconds):
+    seconds = np.asarray(seconds)
+    summary = {'calls': len(seconds), 'calls_per_second': len(seconds) / seconds.sum() if seconds.sum() else None,
+               'mean_ms': seconds.mean() * 1000}
+    for quantile, value in zip(LATENCY_QUANTILES, np.quantile(seconds, LATENCY_QUANTILES)):
+        summary[f'p{round(quantile * 100)}_ms'] = value * 1000
+    return summary
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+# benchmark the app loaded from `data_path`; run in a process of its own so every data file starts fresh
+def measure(data_path, n_states, seed):
+    os.environ['HR_DATA_PATH'] = data_path
+    # a shared figure cache directory would turn cold calls into disk hits
+    os.environ.pop('HR_FIGURE_CACHE_DIR', None)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    start = time.perf_counter()
+    import app
+    load_seconds = time.perf_counter() - start
+    from plotly.io.json import to_json_plotly
+
+    states = filter_states(app, n_states, np.random.default_rng(seed))
+    calls = callback_calls(app)
+    timings = {name: {'cold': [], 'warm': []} for name in calls}
+    for _, state in states:
+        for name, call in calls.items():
+            clear_caches(app)
+            for run in ('cold', 'warm'):
+                start = time.perf_counter()
+                to_json_plotly(call(state))
+                timings[name][run].append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    for _, state in states:
+        for call in calls.values():
+            clear_caches(app)
+            to_json_plotly(call(state))
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    kinds = [kind for kind, _ in states]
+    return {
+        'data_path': data_path,
+        'rows': len(app.snapshot().df),
+        'states': len(states),
+        'state_mix': {kind: kinds.count(kind) for kind in FILTER_MIX if kind in kinds},
+        'load_seconds': load_seconds,
+        'callbacks': {name: {run: latency_summary(values) for run, values in runs.items()}
+                      for name, runs in timings.items()},
+        'peak_memory_mb': {'process_rss': peak_rss_mb(), 'callbacks_traced': traced_peak / 2 ** 20},
+        'serialization': serialization_summary(app, calls, states),
+    }
+
+# %% [markdown]
+# ### Serialization
+#
+# The warm output of every callback is also encoded the way Dash sends it, inside a response dict, once with each of
+# plotly's JSON engines that is installed: `json` is the standard library path, `orjson` the fast one. The table page is
+# encoded a second time as the per-row records it used to be sent as, for comparison with its columnar form.
+
+# %%
+JSON_ENGINES = ['json', 'orjson']
+
+
+# a callback output inside a response like the one Dash encodes
+def dash_response(output):
+    return {'multi': True, 'response': {'output': {'value': output}}}
+
+
+# a table callback output with its columnar page turned back into per-row records
+def page_records(output):
+    page, page_count = output
+    columns = [np.asarray(values).tolist() for values in page['data']]
+    return [dict(zip(page['columns'], row)) for row in zip(*columns)], page_count
+
+
+# mean milliseconds and bytes of encoding each callback's output, per installed JSON engine
+def serialization_summary(app, calls, states):
+    from plotly.io.json import to_json_plotly
+
+    engines = [engine for engine in JSON_ENGINES if engine == 'json' or importlib.util.find_spec(engine)]
+    outputs = {name: [call(state) for _, state in states] for name, call in calls.items()}
+    outputs['update_data_table_records'] = [page_records(output) for output in outputs['update_data_table']]
+
+    summary = {}
+    for name, values in outputs.items():
+        summary[name] = {}
+        for engine in engines:
+            seconds, sizes = [], []
+            for value in values:
+                start = time.perf_counter()
+                sizes.append(len(to_json_plotly(dash_response(value), engine=engine)))
+                seconds.append(time.perf_counter() - start)
+            summary[name][engine] = {'mean_ms': float(np.mean(seconds)) * 1000, 'mean_bytes': float(np.mean(sizes))}
+    return summary
+
+# %%
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the HR dashboard callbacks on synthetic employee data.')
+    parser.add_argument('command', nargs='?', choices=['run', 'generate', 'measure'], default='run')
+    parser.add_argument('--rows', type=int, action='append', help='employees per synthetic file, repeatable')
+    parser.add_argument('--states', type=int, default=40, help='filter states per run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help='where synthetic files are kept between runs (default: a temporary directory)')
+    parser.add_argument('--data', help='measure this csv instead of generating one')
+    parser.add_argument('--output', help='write the JSON report (or, for generate, the csv) here')
+    args = parser.parse_args(argv)
+    row_counts = args.rows or [100000]
+
+    if args.command == 'generate':
+        generate(args.output or f'synthetic-{row_counts[0]}.csv', row_counts[0], args.seed)
+        return
+
+    if args.command == 'measure':
+        json.dump(measure(args.data, args.states, args.seed), sys.stdout)
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='hr-benchmark-')
+    os.makedirs(workdir, exist_ok=True)
+    data_paths = [args.data] if args.data else []
+    for n_rows in row_counts if not args.data else []:
+        path = os.path.join(workdir, f'synthetic-{n_rows}-{args.seed}.csv')
+        if not os.path.exists(path):
+            generate(path, n_rows, args.seed)
+        data_paths.append(path)
+
+    runs = []
+    for path in data_paths:
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), 'measure', '--data', path,
+                                 '--states', str(args.states), '--seed', str(args.seed)],
+                                check=True, stdout=subprocess.PIPE)
+        runs.append(json.loads(result.stdout))
+
+    report = json.dumps({'seed': args.seed, 'python': sys.version.split()[0], 'runs': runs}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report + '\n')
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+# the tests import app.py from the repository root, on the bundled employee csv unless HR_DATA_PATH says otherwise
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('HR_DATA_PATH', os.path.join(ROOT, 'data', 'data.csv'))
+sys.path.insert(0, ROOT)
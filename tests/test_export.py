@@ -0,0 +1,78 @@
+# the export endpoints: the links the page writes stream the table, anything else in the query string is a 400
+import io
+import json
+import urllib.parse
+
+import pandas as pd
+import pytest
+
+import app
+
+SORT_BY = [{'column_id': 'Salary', 'direction': 'desc'}]
+
+
+@pytest.fixture
+def client():
+    return app.server.test_client()
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # several chunks even for the bundled data
+    monkeypatch.setattr(app, 'EXPORT_CHUNK_ROWS', 10)
+
+
+def export(client, kind, spec=app.FilterSpec(), filter_query='', sort_by=SORT_BY):
+    return client.get(f'/export.{kind}?' + app.export_query(spec, filter_query, sort_by))
+
+
+@pytest.mark.parametrize('filters', [
+    {'salary_range': [1]},
+    {'salary_range': 'high'},
+    {'department': 'Sales'},
+    {'gender': ['F']},
+    {'satisfaction': [True]},
+    {'start_date': '2020-13-45', 'end_date': '2021-01-01'},
+    {'unknown': ['x']},
+    ['Sales'],
+])
+def test_malformed_filters_are_a_bad_request(client, filters):
+    response = client.get('/export.csv?' + urllib.parse.urlencode({'filters': json.dumps(filters)}))
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('sort_by', ['[{"column_id": "Unknown", "direction": "asc"}]', '[1]', '{}', 'not json'])
+def test_malformed_sort_is_a_bad_request(client, sort_by):
+    assert client.get('/export.csv?' + urllib.parse.urlencode({'sort_by': sort_by})).status_code == 400
+
+
+def test_csv_export_streams_the_sorted_table(client, small_chunks):
+    response = export(client, 'csv')
+    assert response.status_code == 200
+    frame = pd.read_csv(io.BytesIO(response.data))
+    assert list(frame.columns) == app.TABLE_COLUMN_IDS
+    assert len(frame) == len(app.snapshot().df)
+    assert frame['Salary'].is_monotonic_decreasing
+
+
+def test_parquet_export_matches_csv_export(client, small_chunks):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    if app.pyarrow is None:
+        pytest.skip('app.py was imported without pyarrow')
+    spec = app.FilterSpec.from_inputs(department=['Production'], salary_range=[40000, 90000])
+    data = export(client, 'parquet', spec, '{MaritalDesc} = Single').data
+    assert parquet.ParquetFile(io.BytesIO(data)).num_row_groups > 1
+    frame = parquet.read_table(io.BytesIO(data)).to_pandas()
+    assert len(frame) > 10
+    expected = pd.read_csv(io.BytesIO(export(client, 'csv', spec, '{MaritalDesc} = Single').data))
+    assert list(frame.columns) == list(expected.columns)
+    assert frame['Employee_Name'].astype(str).tolist() == expected['Employee_Name'].tolist()
+    assert frame['Salary'].tolist() == expected['Salary'].tolist()
+
+
+def test_empty_parquet_export_is_a_valid_file(client):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    if app.pyarrow is None:
+        pytest.skip('app.py was imported without pyarrow')
+    data = export(client, 'parquet', app.FilterSpec.from_inputs(department=['No such department'])).data
+    assert parquet.read_table(io.BytesIO(data)).num_rows == 0
@@ -0,0 +1,78 @@
+# the indexes and cube a snapshot update writes row by row must equal the ones built from scratch for the same data
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+@pytest.fixture(scope='module')
+def base():
+    return app.current_dataset().source.current
+
+
+# employees in csv form, parsed the way delta files are
+def employees(raw):
+    buffer = io.StringIO()
+    raw.to_csv(buffer, index=False)
+    return app.load_employees(io.BytesIO(buffer.getvalue().encode()))
+
+
+# changed and new employees, with a department, position and recruitment source the data has not seen
+def delta_rows():
+    raw = pd.read_csv(os.environ['HR_DATA_PATH'], dtype=str, keep_default_na=False)
+    changed = raw.sample(25, random_state=2).copy()
+    changed['Salary'] = (changed['Salary'].astype(int) + 7777).astype(str)
+    changed.iloc[:6, changed.columns.get_loc('Department')] = 'Sales'
+    changed.iloc[6:9, changed.columns.get_loc('Sex')] = 'F'
+    changed.iloc[9:11, changed.columns.get_loc('DateofHire')] = '2019-02-02'
+    new = raw.sample(10, random_state=1).copy()
+    new['EmpID'] = [str(20000 + i) for i in range(len(new))]
+    new.iloc[:4, new.columns.get_loc('Department')] = 'Research'
+    new.iloc[2:6, new.columns.get_loc('Position')] = 'Data Analyst'
+    new.iloc[3:7, new.columns.get_loc('RecruitmentSource')] = 'Referral Program'
+    return employees(pd.concat([changed, new]))
+
+
+def assert_same_indexes(updated, fresh):
+    categories, expected = updated.category_index, fresh.category_index
+    assert categories.n_rows == expected.n_rows
+    assert categories.complete == expected.complete
+    for column, bitmaps in expected.bitmaps.items():
+        assert set(categories.bitmaps[column]) == set(bitmaps), column
+        for value, bits in bitmaps.items():
+            assert np.array_equal(categories.bitmaps[column][value], bits), (column, value)
+
+    ranges = updated.range_index
+    for column, values in fresh.range_index.sorted_values.items():
+        assert np.array_equal(ranges.sorted_values[column], values), column
+        assert np.array_equal(ranges.values[column][ranges.order[column]], values), column
+
+    if fresh.aggregate_cube is not None:
+        keys = list(app.CUBE_DIMENSIONS) + ['SalaryRounded', 'AgeBucket', 'HireYear']
+
+        def cells(cube):
+            frame = cube.cells.astype({column: object for column in app.CUBE_DIMENSIONS})
+            return frame.sort_values(keys).reset_index(drop=True)
+
+        pd.testing.assert_frame_equal(cells(updated.aggregate_cube), cells(fresh.aggregate_cube), check_dtype=False)
+        cube = updated.aggregate_cube
+        assert np.bincount(cube.cell_of_row, minlength=len(cube.cells)).tolist() == cube.cells['count'].tolist()
+
+
+def test_upserted_employees_match_a_fresh_build(base):
+    updated = base.updated(delta_rows(), base.today, 'updated')
+    assert len(updated.df) == len(base.df) + 10
+    assert_same_indexes(updated, app.EmployeeSnapshot(updated.df.copy(), updated.today, version='fresh'))
+
+
+def test_aged_employees_match_a_fresh_build(base):
+    later = base.today + pd.Timedelta(days=200)
+    aged = base.updated(None, later, 'aged')
+    frame = base.df.copy()
+    frame['Age'] = app.employee_ages(frame['DOB'], later)
+    assert (aged.df['Age'] == frame['Age']).all()
+    assert_same_indexes(aged, app.EmployeeSnapshot(frame, later, version='fresh'))